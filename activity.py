@@ -0,0 +1,136 @@
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+class LoginActivityBuffer:
+    """
+    Write-behind buffer for login activity.
+
+    Logins are coalesced per user in memory and written as one unordered
+    bulk_write of $max/$inc updates every flush interval, or sooner once
+    batch_size users are pending. At most max_pending users are held; past
+    that, new events are dropped (and counted) rather than growing memory.
+    """
+    def __init__(self, flush_interval=5.0, batch_size=500, max_pending=10000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._collection_getter = None
+        self._thread = None
+
+    def start(self, collection_getter):
+        """
+        Start the background flusher. collection_getter returns the users
+        collection at flush time.
+        """
+        self._collection_getter = collection_getter
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='login-activity-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def record(self, user_id, at=None):
+        """
+        Note a successful login; never touches the database
+        """
+        if self._collection_getter is None:
+            return
+        at = at or datetime.utcnow()
+        with self._lock:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                if len(self._pending) >= self.max_pending:
+                    self.dropped += 1
+                    return
+                self._pending[user_id] = [at, 1]
+            else:
+                entry[0] = max(entry[0], at)
+                entry[1] += 1
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Write everything pending in one bulk_write, returns the number of users written
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending or self._collection_getter is None:
+                return 0
+
+            operations = [
+                UpdateOne({'_id': user_id}, {
+                    '$max': {'last_login_at': last_login_at},
+                    '$inc': {'login_count': count}
+                })
+                for user_id, (last_login_at, count) in pending.items()
+            ]
+            try:
+                self._collection_getter().bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # Unordered: everything but the listed operations was applied
+                failed = {error['index'] for error in e.details.get('writeErrors', [])}
+                logger.error(f"Login activity flush failed for {len(failed)} of {len(operations)} users")
+                self._requeue({user_id: entry for index, (user_id, entry) in enumerate(pending.items())
+                               if index in failed})
+                return len(operations) - len(failed)
+            except Exception as e:
+                logger.error(f"Login activity flush failed for {len(operations)} users: {e}")
+                self._requeue(pending)
+                return 0
+            return len(operations)
+
+    def _requeue(self, pending):
+        """
+        Merge a failed batch back in for the next flush, within max_pending
+        """
+        with self._lock:
+            for user_id, (last_login_at, count) in pending.items():
+                entry = self._pending.get(user_id)
+                if entry is not None:
+                    entry[0] = max(entry[0], last_login_at)
+                    entry[1] += count
+                elif len(self._pending) < self.max_pending:
+                    self._pending[user_id] = [last_login_at, count]
+                else:
+                    self.dropped += count
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self):
+        """
+        Stop the flusher and write whatever is still pending
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+            self._thread = None
+        self.flush()
+
+
+login_activity = LoginActivityBuffer(
+    flush_interval=float(os.getenv('LOGIN_ACTIVITY_FLUSH_SECONDS', 5)),
+    batch_size=int(os.getenv('LOGIN_ACTIVITY_BATCH_SIZE', 500)),
+    max_pending=int(os.getenv('LOGIN_ACTIVITY_MAX_PENDING', 10000))
+)
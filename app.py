@@ -1,13 +1,31 @@
 # app.py
 from flask import Flask, request, jsonify, send_from_directory
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import (
+    JWTManager, create_access_token, create_refresh_token, decode_token,
+    get_jwt_identity, get_jwt, get_jwt_header
+)
 from flask_bcrypt import Bcrypt
 from flask_swagger_ui import get_swaggerui_blueprint
-from models import User
-from config import mongo, client, db
+from models import User, RefreshToken, SEARCH_FIELDS, user_lookups
+from cache import TTLCache
+from bloom import availability_filter
+from activity import login_activity
+from registration import registration_queue
+from slow_queries import slow_query_monitor
+import dbstats
+import resilience
+from validation import validate_body
+from auth import jwt_required, service_token_required
+from idempotency import idempotent
+from batch import run_batch
+from claims import CLAIM_FIELDS, profile_changes, profile_claims, profile_changed, profile_from_claims
+from config import mongo, client, db, storage_backend
+import math
 import os
 import logging
+from datetime import datetime, timedelta
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from bson.objectid import ObjectId
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -38,13 +56,64 @@ def serve_swagger():
 
 # JWT Configuration
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'fallback-secret-key')
+app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=int(os.getenv('JWT_REFRESH_TOKEN_DAYS', 30)))
+# Issue a new refresh token on every refresh and retire the old one
+REFRESH_TOKEN_ROTATION = os.getenv('REFRESH_TOKEN_ROTATION', 'true').lower() == 'true'
+# Embed stable profile fields in access tokens so GET /profile can skip Mongo
+app.config.setdefault('PROFILE_CLAIMS', os.getenv('PROFILE_CLAIMS', 'false').lower() == 'true')
+# Queue registrations (202 + status polling) instead of hashing in the request
+app.config.setdefault('ASYNC_REGISTRATION', os.getenv('ASYNC_REGISTRATION', 'false').lower() == 'true')
+# Shared secret internal services present to read other users' profiles
+# (/users, /users/search, /users/changes); unset disables those routes
+app.config.setdefault('SERVICE_API_KEY', os.getenv('SERVICE_API_KEY'))
 jwt = JWTManager(app)
 bcrypt = Bcrypt(app)
 
+# Per-request DB round trip accounting and budgets
+dbstats.init_app(app)
+
+# Per-route Mongo deadlines and the database circuit breaker
+resilience.init_app(app)
+
+@jwt.token_in_blocklist_loader
+def check_if_token_revoked(jwt_header, jwt_payload):
+    # Access tokens are short-lived and never looked up; refresh tokens are
+    # checked against their stored state
+    if jwt_payload.get('type') != 'refresh':
+        return False
+    return RefreshToken.is_revoked(db, jwt_payload['jti'])
+
+def issue_refresh_token(user_id):
+    """
+    Create a refresh token and record it for rotation/revocation
+    """
+    refresh_token = create_refresh_token(identity=user_id)
+    decoded = decode_token(refresh_token)
+    RefreshToken.store(db, decoded['jti'], user_id, datetime.utcfromtimestamp(decoded['exp']))
+    return refresh_token, decoded['jti']
+
+def issue_access_token(user_id, user=None):
+    """
+    Create an access token, carrying the profile when PROFILE_CLAIMS is on
+    """
+    claims = None
+    if app.config['PROFILE_CLAIMS']:
+        if user is None:
+            # Re-read for the claims: one round trip beyond the route's budget
+            dbstats.extend_budget(1)
+            user = User.get_user_by_id(db, user_id, coalesce=False)
+        if user:
+            claims = profile_claims(user)
+    return create_access_token(identity=user_id, additional_claims=claims)
+
 def check_db_connection():
     """
     Check MongoDB connection during app initialization
     """
+    if storage_backend == 'memory':
+        logger.info("Using in-memory storage, no MongoDB connection needed")
+        return
+    
     try:
         # Attempt to ping the database
         client.admin.command('ping')
@@ -56,6 +125,22 @@ def check_db_connection():
 # Call connection check during app initialization
 check_db_connection()
 
+# Warm the username/email availability filter from existing users, then keep
+# it current with users created by other processes
+availability_filter.warm(db.users)
+availability_filter.start(lambda: db.users)
+
+# Flush buffered login activity (last_login_at, login_count) in the background
+login_activity.start(lambda: db.users)
+
+# Learn about profile changes made on other workers
+if app.config['PROFILE_CLAIMS']:
+    profile_changes.start(lambda: db.profile_changes)
+
+# Hash and insert queued registrations in the background
+if app.config['ASYNC_REGISTRATION']:
+    registration_queue.start(lambda: db)
+
 # Home Route
 @app.route('/')
 def home():
@@ -63,6 +148,8 @@ def home():
 
 # User Registration
 @app.route('/register', methods=['POST'])
+@validate_body('UserRegistration')
+@idempotent()
 def register():
     try:
         data = request.get_json()
@@ -70,10 +157,15 @@ def register():
         # Log incoming registration request
         logger.info(f"Registration attempt for username: {data.get('username')}")
         
-        # Validate input
-        if not data or not data.get('username') or not data.get('email') or not data.get('password'):
-            logger.warning("Missing required fields in registration")
-            return jsonify({"error": "Missing required fields"}), 400
+        if app.config['ASYNC_REGISTRATION']:
+            job_id = str(registration_queue.enqueue(db, data))
+            response = jsonify({
+                "message": "Registration accepted",
+                "job_id": job_id,
+                "status_url": f"/register/status/{job_id}"
+            })
+            response.headers['Location'] = f"/register/status/{job_id}"
+            return response, 202
         
         # Create user
         try:
@@ -110,29 +202,106 @@ def register():
             "details": str(e)
         }), 500
 
+# Queued Registration Status
+@app.route('/register/status/<job_id>', methods=['GET'])
+def registration_status(job_id):
+    try:
+        try:
+            status = registration_queue.status(db, job_id)
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+        
+        if status is None:
+            return jsonify({"error": "Registration job not found"}), 404
+        
+        return jsonify(status), 200
+    
+    except Exception as e:
+        logger.error(f"Registration status error: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve registration status"}), 500
+
+# Username / Email Availability
+@app.route('/availability', methods=['GET'])
+def availability():
+    try:
+        username = request.args.get('username')
+        email = request.args.get('email')
+        
+        # Validate input
+        if not username and not email:
+            return jsonify({"error": "Provide a username or email to check"}), 400
+        
+        result = {}
+        if username:
+            result['username'] = {'value': username, 'available': User.is_available(db, 'username', username)}
+        if email:
+            result['email'] = {'value': email, 'available': User.is_available(db, 'email', email)}
+        
+        return jsonify(result), 200
+    
+    except Exception as e:
+        logger.error(f"Availability check error: {str(e)}", exc_info=True)
+        return jsonify({"error": "Availability check failed"}), 500
+
 # User Login
 @app.route('/login', methods=['POST'])
+@validate_body('UserLogin')
 def login():
     try:
         data = request.get_json()
         
-        # Validate input
-        if not data or not data.get('username') or not data.get('password'):
-            return jsonify({"error": "Missing username or password"}), 400
-        
         # Authenticate user
         user = User.authenticate(db, data['username'], data['password'])
         
         if user:
-            # Create access token
-            access_token = create_access_token(identity=str(user['_id']))
-            return jsonify(access_token=access_token), 200
+            # Create access and refresh tokens
+            access_token = issue_access_token(str(user.id), user)
+            refresh_token, _ = issue_refresh_token(str(user.id))
+            return jsonify(access_token=access_token, refresh_token=refresh_token), 200
         
         return jsonify({"error": "Invalid credentials"}), 401
     
     except Exception as e:
         return jsonify({"error": "Login failed"}), 500
 
+# Refresh Access Token
+@app.route('/token/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    try:
+        current_user_id = get_jwt_identity()
+        response = {}
+        
+        if REFRESH_TOKEN_ROTATION:
+            refresh_token, new_jti = issue_refresh_token(current_user_id)
+            
+            # Losing this race means the token was used twice: treat it as stolen
+            if not RefreshToken.rotate(db, get_jwt()['jti'], new_jti):
+                RefreshToken.revoke_all(db, current_user_id)
+                return jsonify({"error": "Refresh token has been revoked"}), 401
+            
+            response['refresh_token'] = refresh_token
+        
+        # New access token without re-checking the password
+        response['access_token'] = issue_access_token(current_user_id)
+        return jsonify(response), 200
+    
+    except Exception as e:
+        logger.error(f"Token refresh error: {str(e)}", exc_info=True)
+        return jsonify({"error": "Token refresh failed"}), 500
+
+# Revoke Refresh Token
+@app.route('/token/revoke', methods=['POST'])
+@jwt_required(refresh=True)
+def revoke_refresh_token():
+    try:
+        RefreshToken.revoke(db, get_jwt()['jti'])
+        return jsonify({"message": "Refresh token revoked"}), 200
+    
+    except Exception as e:
+        logger.error(f"Token revoke error: {str(e)}", exc_info=True)
+        return jsonify({"error": "Token revoke failed"}), 500
+
 # Get User Profile
 @app.route('/profile', methods=['GET'])
 @jwt_required()
@@ -140,26 +309,29 @@ def get_profile():
     try:
         current_user_id = get_jwt_identity()
         
-        # Ensure current_user_id is converted to ObjectId if it's a string
-        if isinstance(current_user_id, str):
-            from bson import ObjectId
-            current_user_id = ObjectId(current_user_id)
+        # Only fetch the fields the client asked for (?fields=first_name,email)
+        try:
+            fields = User.profile_fields(request.args.get('fields'))
+        except ValueError as ve:
+            return jsonify({"error": str(ve), "field": "fields"}), 400
+        
+        # Answer from the verified token when it carries a current profile;
+        # by default that means the fields a token can carry
+        if app.config['PROFILE_CLAIMS'] and not request.args.get('fields'):
+            fields = CLAIM_FIELDS
+        profile = profile_from_claims(get_jwt(), current_user_id, fields)
+        if profile is not None:
+            return jsonify(profile), 200
         
         # Retrieve user with specific error handling
-        user = db.users.find_one({'_id': current_user_id})
+        user = User.get_user_by_id(db, current_user_id, fields)
         
         if not user:
             # Specific error for user not found
             logger.warning(f"Profile retrieval failed: User not found for ID {current_user_id}")
             return jsonify({"error": "User not found"}), 404
         
-        # Remove sensitive information
-        user.pop('password_hash', None)
-        
-        # Convert ObjectId to string for JSON serialization
-        user['_id'] = str(user['_id'])
-        
-        return jsonify(user), 200
+        return jsonify(user.to_json(fields)), 200
     
     except Exception as e:
         # Log the full error for debugging
@@ -172,15 +344,12 @@ def get_profile():
 # Edit User Profile
 @app.route('/profile', methods=['PUT'])
 @jwt_required()
+@validate_body('ProfileUpdate')
 def edit_profile():
     try:
         current_user_id = get_jwt_identity()
         data = request.get_json()
         
-        # Validate input
-        if not data or (not data.get('first_name') and not data.get('last_name')):
-            return jsonify({"error": "No profile data provided"}), 400
-        
         # Update user profile
         success = User.update_user(db, current_user_id, {
             'first_name': data.get('first_name'),
@@ -190,9 +359,12 @@ def edit_profile():
         if not success:
             return jsonify({"error": "Failed to update profile"}), 400
         
+        # Tokens issued before this edit carry the old profile
+        profile_changed(current_user_id)
+        
         # Retrieve updated user
-        updated_user = User.get_user_by_id(db, current_user_id)
-        return jsonify(updated_user), 200
+        updated_user = User.get_user_by_id(db, current_user_id, coalesce=False)
+        return jsonify(updated_user.to_json()), 200
     
     except Exception as e:
         logger.error(f"Profile update error: {str(e)}", exc_info=True)
@@ -201,19 +373,13 @@ def edit_profile():
 # Change Password
 @app.route('/change-password', methods=['POST'])
 @jwt_required()
+@validate_body('ChangePassword')
+@idempotent(per_user=True)
 def change_password():
     try:
         current_user_id = get_jwt_identity()
         data = request.get_json()
         
-        # Validate input
-        if not data.get('current_password') or not data.get('new_password'):
-            return jsonify({"error": "Missing current or new password"}), 400
-        
-        # Validate new password length
-        if len(data['new_password']) < 6:
-            return jsonify({"error": "New password must be at least 6 characters long"}), 400
-        
         # Change password
         success = User.change_password(
             db, 
@@ -225,6 +391,11 @@ def change_password():
         if not success:
             return jsonify({"error": "Password change failed"}), 400
         
+        profile_changed(current_user_id)
+        
+        # Sessions started with the old password must log in again
+        RefreshToken.revoke_all(db, current_user_id)
+        
         return jsonify({"message": "Password changed successfully"}), 200
     
     except Exception as e:
@@ -238,6 +409,170 @@ def logout():
     # In JWT, logout is typically handled client-side by removing the token
     return jsonify({"message": "Logged out successfully"}), 200
 
+# Popular type-ahead prefixes are answered from memory for a few seconds
+search_cache = TTLCache(
+    maxsize=int(os.getenv('SEARCH_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('SEARCH_CACHE_TTL', 30))
+)
+SEARCH_MAX_LIMIT = 50
+
+# Search Users
+@app.route('/users/search', methods=['GET'])
+@service_token_required('SERVICE_API_KEY')
+def search_users():
+    try:
+        prefix = request.args.get('q', '').strip()
+        field = request.args.get('field', 'username')
+        after = request.args.get('after')
+        
+        # Validate input
+        if not prefix:
+            return jsonify({"error": "Missing search query", "field": "q"}), 400
+        if field not in ('username', 'email'):
+            return jsonify({"error": "Field must be username or email", "field": "field"}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', 10)), 1), SEARCH_MAX_LIMIT)
+        except ValueError:
+            return jsonify({"error": "Limit must be an integer", "field": "limit"}), 400
+        
+        cache_key = (field, prefix.lower(), limit, after)
+        result = search_cache.get(cache_key)
+        if result is None:
+            try:
+                users, next_cursor = User.search(db, prefix, field, limit, after)
+            except ValueError as ve:
+                return jsonify({"error": str(ve), "field": "after"}), 400
+            result = {
+                'users': [user.to_json(SEARCH_FIELDS) for user in users],
+                'next': next_cursor
+            }
+            search_cache.set(cache_key, result)
+        
+        return jsonify(result), 200
+    
+    except Exception as e:
+        logger.error(f"User search error: {str(e)}", exc_info=True)
+        return jsonify({"error": "User search failed"}), 500
+
+# Multi-get of user profiles
+USERS_MAX_IDS = 500
+
+def users_by_ids(raw_ids):
+    """
+    Profiles for the requested ids in request order, None for ids not found
+    """
+    if not raw_ids:
+        return jsonify({"error": "Provide at least one user id", "field": "ids"}), 400
+    if len(raw_ids) > USERS_MAX_IDS:
+        return jsonify({"error": f"At most {USERS_MAX_IDS} ids per request", "field": "ids"}), 400
+    if not all(isinstance(raw_id, str) and ObjectId.is_valid(raw_id) for raw_id in raw_ids):
+        return jsonify({"error": "Invalid user id", "field": "ids"}), 400
+    user_ids = [ObjectId(raw_id) for raw_id in raw_ids]
+    
+    found = User.get_users_by_ids(db, user_ids)
+    users = [found[user_id].to_json() if user_id in found else None for user_id in user_ids]
+    missing = [str(user_id) for user_id in dict.fromkeys(user_ids) if user_id not in found]
+    return jsonify({'users': users, 'missing': missing}), 200
+
+# Get Users by Id
+@app.route('/users', methods=['GET'])
+@service_token_required('SERVICE_API_KEY')
+def get_users():
+    try:
+        ids = request.args.get('ids', '')
+        return users_by_ids([raw_id.strip() for raw_id in ids.split(',') if raw_id.strip()])
+    except Exception as e:
+        logger.error(f"User multi-get error: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve users"}), 500
+
+# Get Users by Id (long id lists)
+@app.route('/users', methods=['POST'])
+@service_token_required('SERVICE_API_KEY')
+@validate_body('UserIds')
+def get_users_bulk():
+    try:
+        return users_by_ids(request.get_json()['ids'])
+    except Exception as e:
+        logger.error(f"User multi-get error: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve users"}), 500
+
+# Change feed for downstream copies of user profiles
+CHANGES_MAX_LIMIT = 500
+CHANGES_MAX_WAIT = 25
+CHANGES_SETTLE_SECONDS = float(os.getenv('CHANGES_SETTLE_SECONDS', 1))
+
+# Users Changed Since a Cursor
+@app.route('/users/changes', methods=['GET'])
+@service_token_required('SERVICE_API_KEY')
+def user_changes():
+    try:
+        since = request.args.get('since')
+        try:
+            limit = min(max(int(request.args.get('limit', 100)), 1), CHANGES_MAX_LIMIT)
+        except ValueError:
+            return jsonify({"error": "Limit must be an integer", "field": "limit"}), 400
+        try:
+            wait = float(request.args.get('wait', 0))
+            if not math.isfinite(wait):
+                raise ValueError(wait)
+            wait = min(max(wait, 0), CHANGES_MAX_WAIT)
+        except ValueError:
+            return jsonify({"error": "Wait must be a number of seconds", "field": "wait"}), 400
+        
+        try:
+            users, next_cursor, has_more = User.changes(db, since, limit, wait, CHANGES_SETTLE_SECONDS)
+        except ValueError as ve:
+            return jsonify({"error": str(ve), "field": "since"}), 400
+        
+        return jsonify({
+            'users': [user.to_json() for user in users],
+            'next': next_cursor,
+            'has_more': has_more
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"User changes error: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve user changes"}), 500
+
+# Metrics
+@app.route('/metrics', methods=['GET'])
+@jwt_required()
+def metrics():
+    return jsonify({
+        'user_lookups': user_lookups.stats(),
+        'slow_queries': {
+            'slow': slow_query_monitor.slow_count,
+            'explained': slow_query_monitor.explained_count
+        },
+        'circuit_breaker': resilience.breaker.stats()
+    }), 200
+
+# Batch API
+@app.route('/batch', methods=['POST'])
+@jwt_required(optional=True)
+@validate_body('BatchRequest')
+def batch():
+    try:
+        data = request.get_json()
+        
+        # Decode the caller's token once and hand it to every sub-request
+        jwt_data = get_jwt()
+        preverified_jwt = (get_jwt_header(), jwt_data) if jwt_data else None
+        
+        responses = run_batch(
+            app,
+            data['requests'],
+            request.headers,
+            preverified_jwt=preverified_jwt,
+            concurrent=bool(data.get('concurrent'))
+        )
+        
+        return jsonify(responses=responses), 200
+    
+    except Exception as e:
+        logger.error(f"Batch error: {str(e)}", exc_info=True)
+        return jsonify({"error": "Batch failed"}), 500
+
 # # Register the product blueprint
 # app.register_blueprint(product_bp)
 
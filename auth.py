@@ -0,0 +1,55 @@
+import hmac
+from functools import wraps
+from flask import request, current_app, g, jsonify
+from flask_jwt_extended import jwt_required as flask_jwt_required
+
+# WSGI environ key the batch dispatcher uses to hand an already verified
+# token to its sub-requests (clients cannot set it: headers become HTTP_*)
+PREVERIFIED_JWT_KEY = 'app.preverified_jwt'
+
+# Header carrying the shared secret of service-to-service routes
+SERVICE_TOKEN_HEADER = 'X-Service-Token'
+
+
+def jwt_required(optional=False, fresh=False, refresh=False, **options):
+    """
+    flask_jwt_extended.jwt_required that skips decoding a second time when the
+    request carries a token the batch endpoint has already verified
+    """
+    def decorator(view):
+        protected = flask_jwt_required(optional=optional, fresh=fresh, refresh=refresh, **options)(view)
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            preverified = request.environ.get(PREVERIFIED_JWT_KEY)
+            # Only plain access-token routes can reuse the outer verification
+            if preverified is not None and not (fresh or refresh or options):
+                jwt_header, jwt_data = preverified
+                if jwt_data.get('type') == 'access':
+                    g._jwt_extended_jwt_user = {'loaded_user': None}
+                    g._jwt_extended_jwt_header = jwt_header
+                    g._jwt_extended_jwt = jwt_data
+                    g._jwt_extended_jwt_location = 'headers'
+                    return current_app.ensure_sync(view)(*args, **kwargs)
+            return protected(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def service_token_required(config_key):
+    """
+    Restrict a route to services presenting app.config[config_key] in the
+    X-Service-Token header. The route is disabled while the key is unset.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            expected = current_app.config.get(config_key)
+            if not expected:
+                return jsonify({"error": "Endpoint is disabled"}), 403
+            token = request.headers.get(SERVICE_TOKEN_HEADER, '')
+            if not hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8')):
+                return jsonify({"error": "Invalid or missing service token"}), 401
+            return current_app.ensure_sync(view)(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,72 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
+from werkzeug.test import EnvironBuilder
+from auth import PREVERIFIED_JWT_KEY
+
+# Upper bound on threads used for one concurrent batch
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', 8))
+
+# Headers copied from the batch request onto every sub-request
+FORWARDED_HEADERS = ('Authorization',)
+
+# Methods a batch entry may use
+ALLOWED_METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+
+def run_subrequest(app, sub_request, headers, preverified_jwt):
+    """
+    Dispatch one sub-request through the app's URL map and return its response
+    as a dict. Each sub-request gets its own app context, so `g` is not shared.
+    """
+    if not isinstance(sub_request, dict) or not isinstance(sub_request.get('path'), str):
+        return {'status': 400, 'body': {'error': "Each batch entry needs a path"}}
+
+    path = sub_request['path']
+    if not path.startswith('/'):
+        return {'status': 400, 'body': {'error': f"Invalid batch path: {path}"}}
+
+    method = sub_request.get('method', 'GET')
+    if not isinstance(method, str) or method.upper() not in ALLOWED_METHODS:
+        return {'status': 400, 'body': {'error': f"Invalid batch method: {method}"}}
+
+    entry_headers = sub_request.get('headers') or {}
+    if not isinstance(entry_headers, dict) or not all(
+            isinstance(name, str) and isinstance(value, str) for name, value in entry_headers.items()):
+        return {'status': 400, 'body': {'error': "Batch entry headers must map names to strings"}}
+
+    sub_headers = dict(headers)
+    sub_headers.update(entry_headers)
+    builder = EnvironBuilder(
+        path=path,
+        method=method.upper(),
+        json=sub_request.get('body'),
+        headers=sub_headers
+    )
+    environ = builder.get_environ()
+    builder.close()
+    if preverified_jwt is not None:
+        environ[PREVERIFIED_JWT_KEY] = preverified_jwt
+
+    with app.app_context(), app.request_context(environ):
+        # Match on the routed endpoint so encoded or aliased paths cannot nest a batch
+        if request.endpoint == 'batch':
+            return {'status': 400, 'body': {'error': f"Invalid batch path: {path}"}}
+        response = app.full_dispatch_request()
+        return {'status': response.status_code, 'body': response.get_json(silent=True)}
+
+
+def run_batch(app, sub_requests, headers, preverified_jwt=None, concurrent=False):
+    """
+    Run every sub-request and return their responses in request order
+    """
+    forwarded = {name: headers[name] for name in FORWARDED_HEADERS if name in headers}
+
+    def run(sub_request):
+        return run_subrequest(app, sub_request, forwarded, preverified_jwt)
+
+    if not concurrent or len(sub_requests) < 2:
+        return [run(sub_request) for sub_request in sub_requests]
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(sub_requests))) as executor:
+        return list(executor.map(run, sub_requests))
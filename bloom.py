@@ -0,0 +1,167 @@
+import atexit
+import hashlib
+import math
+import os
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+
+logger = logging.getLogger(__name__)
+
+# Incremental refreshes re-read users whose _id is this much older than the
+# last refresh, covering clock skew between the processes minting ids
+ID_CLOCK_SKEW = timedelta(seconds=60)
+
+
+class BloomFilter:
+    """
+    Fixed size bloom filter: no false negatives, tunable false positive rate
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, value):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        positions = self._positions(value)
+        with self._lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(value))
+
+    def clear(self):
+        with self._lock:
+            self.bits = bytearray(len(self.bits))
+
+
+class AvailabilityFilter:
+    """
+    Bloom filters over taken usernames and emails.
+
+    Warmed from the users collection at startup and fed by User.create_user.
+    A background thread picks up users created by other processes every
+    refresh_interval seconds (by _id) and rebuilds the filters from scratch
+    every rebuild_interval, so a "free" answer is advisory for at most
+    refresh_interval; the unique indexes remain the source of truth.
+    """
+    def __init__(self, capacity=None, error_rate=0.01, refresh_interval=30.0, rebuild_interval=3600.0):
+        self.capacity = capacity or int(os.getenv('AVAILABILITY_FILTER_CAPACITY', 1000000))
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.usernames = BloomFilter(self.capacity, error_rate)
+        self.emails = BloomFilter(self.capacity, error_rate)
+        self._since = None      # every user with an older _id has been loaded
+        self._recent = None     # users added while a rebuild is loading
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._collection_getter = None
+        self._thread = None
+
+    def add(self, username, email):
+        with self._lock:
+            self.usernames.add(username)
+            self.emails.add(email)
+            if self._recent is not None:
+                self._recent.append((username, email))
+
+    def _load(self, collection, query, usernames, emails):
+        count = 0
+        for user in collection.find(query, projection={'username': 1, 'email': 1, '_id': 0}):
+            if user.get('username'):
+                usernames.add(user['username'])
+            if user.get('email'):
+                emails.add(user['email'])
+            count += 1
+        return count
+
+    def warm(self, collection):
+        """
+        Load every existing username and email into new filters and swap them
+        in, so lookups keep using the old ones until the load is complete.
+        Returns the number of users seen.
+        """
+        usernames = BloomFilter(self.capacity, self.error_rate)
+        emails = BloomFilter(self.capacity, self.error_rate)
+        started = datetime.utcnow()
+        with self._lock:
+            self._recent = []
+        try:
+            count = self._load(collection, {}, usernames, emails)
+        finally:
+            with self._lock:
+                recent, self._recent = self._recent, None
+        with self._lock:
+            for username, email in recent:
+                usernames.add(username)
+                emails.add(email)
+            self.usernames, self.emails = usernames, emails
+            self._since = ObjectId.from_datetime(started - ID_CLOCK_SKEW)
+        logger.info(f"Availability filter warmed with {count} users")
+        return count
+
+    def refresh(self, collection):
+        """
+        Add users created since the last warm or refresh, returns the number seen
+        """
+        if self._since is None:
+            return self.warm(collection)
+        started = datetime.utcnow()
+        count = self._load(collection, {'_id': {'$gte': self._since}}, self.usernames, self.emails)
+        self._since = ObjectId.from_datetime(started - ID_CLOCK_SKEW)
+        return count
+
+    def start(self, collection_getter):
+        """
+        Start the background refresher. collection_getter returns the users
+        collection at refresh time.
+        """
+        self._collection_getter = collection_getter
+        if self._thread is None and self.refresh_interval > 0:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='availability-filter-refresher', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        rebuilt_at = time.monotonic()
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                if self.rebuild_interval and time.monotonic() - rebuilt_at >= self.rebuild_interval:
+                    self.warm(self._collection_getter())
+                    rebuilt_at = time.monotonic()
+                else:
+                    self.refresh(self._collection_getter())
+            except Exception as e:
+                logger.error(f"Availability filter refresh failed: {e}")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def username_maybe_taken(self, username):
+        return username in self.usernames
+
+    def email_maybe_taken(self, email):
+        return email in self.emails
+
+
+availability_filter = AvailabilityFilter(
+    refresh_interval=float(os.getenv('AVAILABILITY_FILTER_REFRESH_SECONDS', 30)),
+    rebuild_interval=float(os.getenv('AVAILABILITY_FILTER_REBUILD_SECONDS', 3600))
+)
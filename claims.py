@@ -0,0 +1,191 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from config import db
+from dbstats import extend_budget
+
+logger = logging.getLogger(__name__)
+
+# Access token claim holding the embedded profile
+PROFILE_CLAIM = 'profile'
+
+# Profile fields that only change through edit_profile/change_password, so a
+# token may carry them. last_login_at/login_count change on every login.
+CLAIM_FIELDS = ('_id', 'username', 'email', 'first_name', 'last_name', 'created_at', 'updated_at')
+
+# Polls of the shared profile_changes collection re-read this many seconds
+# before the previous poll, covering clock skew between workers
+SYNC_OVERLAP_SECONDS = 5
+
+
+class ProfileChanges:
+    """
+    When each user's profile last changed, kept for as long as access tokens
+    issued before the change can live.
+
+    Changes are written to the shared profile_changes collection and every
+    process polls it each sync_interval seconds, so a change made on one
+    worker reaches the others within that interval. Markers are never evicted:
+    once maxsize users are tracked, further changes mark every token issued
+    until then as stale, which sends those profiles to the database instead.
+    """
+    def __init__(self, maxsize=100000, sync_interval=1.0):
+        self.maxsize = maxsize
+        self.sync_interval = sync_interval
+        self._changes = {}          # user id -> (changed_at, forget_at)
+        self._overflow_at = 0.0     # tokens issued up to then are all stale
+        self._overflow_until = 0.0
+        self._since = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._collection_getter = None
+        self._thread = None
+
+    def _record(self, user_id, changed_at, lifetime):
+        forget_at = None if lifetime is None else changed_at + lifetime
+        with self._lock:
+            current = self._changes.get(user_id)
+            if current is not None and current[0] >= changed_at:
+                return
+            if current is None and len(self._changes) >= self.maxsize:
+                now = time.time()
+                self._changes = {k: v for k, v in self._changes.items() if v[1] is None or v[1] > now}
+            if current is None and len(self._changes) >= self.maxsize:
+                self._overflow_at = max(self._overflow_at, changed_at)
+                self._overflow_until = None if lifetime is None or self._overflow_until is None else max(
+                    self._overflow_until, forget_at)
+                return
+            self._changes[user_id] = (changed_at, forget_at)
+
+    def changed_at(self, user_id):
+        """
+        Last change time for user_id that a token must be newer than, or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._changes.get(user_id)
+            if entry is not None and entry[1] is not None and entry[1] <= now:
+                del self._changes[user_id]
+                entry = None
+            overflow = self._overflow_at if self._overflow_until is None or self._overflow_until > now else None
+        changed = entry[0] if entry else None
+        if overflow and (changed is None or overflow > changed):
+            return overflow
+        return changed
+
+    def changed(self, user_id, lifetime):
+        """
+        Record a change now, here and for every other worker
+        """
+        changed_at = time.time()
+        self._record(user_id, changed_at, lifetime)
+        expires_at = datetime.utcnow() + timedelta(seconds=lifetime if lifetime is not None else 365 * 86400)
+        db.profile_changes.update_one(
+            {'_id': user_id},
+            {'$max': {'changed_at': changed_at, 'expires_at': expires_at}, '$set': {'lifetime': lifetime}},
+            upsert=True
+        )
+
+    def sync(self, collection):
+        """
+        Pick up changes other workers made since the last sync
+        """
+        started = time.time()
+        query = {} if self._since is None else {'changed_at': {'$gte': self._since}}
+        count = 0
+        for change in collection.find(query):
+            self._record(change['_id'], change['changed_at'], change.get('lifetime'))
+            count += 1
+        self._since = started - SYNC_OVERLAP_SECONDS
+        return count
+
+    def start(self, collection_getter):
+        """
+        Start polling. collection_getter returns the profile_changes collection.
+        """
+        self._collection_getter = collection_getter
+        if self._thread is None and self.sync_interval > 0:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='profile-changes-sync', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(self.sync_interval):
+            try:
+                self.sync(self._collection_getter())
+            except Exception as e:
+                logger.error(f"Profile change sync failed: {e}")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def clear(self):
+        with self._lock:
+            self._changes = {}
+            self._overflow_at = 0.0
+            self._overflow_until = 0.0
+
+
+profile_changes = ProfileChanges(
+    maxsize=int(os.getenv('PROFILE_CHANGES_CACHE_SIZE', 100000)),
+    sync_interval=float(os.getenv('PROFILE_CHANGES_SYNC_SECONDS', 1))
+)
+
+
+def _token_lifetime():
+    """
+    Seconds an access token lives, or None if they never expire
+    """
+    expires = current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+    if expires is False:
+        return None
+    if isinstance(expires, timedelta):
+        return expires.total_seconds()
+    return float(expires)
+
+
+def profile_claims(user):
+    """
+    Additional access token claims for user, encoded exactly as GET /profile
+    would return them
+    """
+    return {PROFILE_CLAIM: json.loads(current_app.json.dumps(user.to_json(CLAIM_FIELDS)))}
+
+
+def profile_changed(user_id):
+    """
+    Stop serving profiles from tokens issued before now
+    """
+    if not current_app.config['PROFILE_CLAIMS']:
+        return
+    # Publishing the change to the other workers costs a round trip
+    extend_budget(1)
+    profile_changes.changed(str(user_id), _token_lifetime())
+
+
+def profile_from_claims(jwt_data, user_id, fields):
+    """
+    The requested fields from a verified token, or None when the token has no
+    profile, lacks a field, or predates the user's last profile change.
+    Tokens issued while PROFILE_CLAIMS was on are ignored once it is off, as
+    changes are no longer recorded then.
+    """
+    if not current_app.config['PROFILE_CLAIMS']:
+        return None
+    profile = jwt_data.get(PROFILE_CLAIM)
+    if profile is None or not set(fields) <= set(CLAIM_FIELDS):
+        return None
+    # iat has whole-second precision: a change within the issuing second counts as newer
+    changed_at = profile_changes.changed_at(str(user_id))
+    if changed_at is not None and changed_at >= jwt_data.get('iat', 0):
+        return None
+    return {field: profile.get(field) for field in fields}
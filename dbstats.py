@@ -0,0 +1,117 @@
+import logging
+import os
+import time
+from functools import wraps
+from flask import g, request, has_request_context
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Maximum Mongo round trips per endpoint. Exceeding one logs a warning, and
+# tests/test_dbstats.py fails, so an extra query cannot ship unnoticed.
+ROUTE_BUDGETS = {
+    'register': 2,           # duplicate check + insert (job insert when queued)
+    'registration_status': 1,
+    'login': 2,              # user lookup + refresh token insert
+    'refresh': 3,            # revocation check + new token + rotation
+    'get_profile': 1,
+    'edit_profile': 2,       # update + read back
+    'change_password': 3,    # lookup + update + refresh token revocation
+    'availability': 2,       # at most one query per checked value
+    'get_users': 1,          # one $in query however many ids
+    'get_users_bulk': 1,
+}
+
+# Collection methods that cost a round trip
+COUNTED_METHODS = {
+    'find', 'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many',
+    'delete_one', 'delete_many', 'replace_one', 'find_one_and_update', 'bulk_write',
+    'count_documents', 'aggregate', 'distinct'
+}
+
+
+def extend_budget(calls):
+    """
+    Allow the current request more round trips than its route budget, for
+    work only some requests to the route do (e.g. an Idempotency-Key)
+    """
+    if has_request_context():
+        g.db_budget_extra = g.get('db_budget_extra', 0) + calls
+
+
+def record_call(duration_seconds):
+    """
+    Add one Mongo round trip to the current request's totals
+    """
+    if has_request_context():
+        stats = g.setdefault('db_stats', [0, 0.0])
+        stats[0] += 1
+        stats[1] += duration_seconds
+
+
+class DBCallCounter(monitoring.CommandListener):
+    """
+    Counts commands sent by pymongo while a request is active. Listeners run
+    on the thread sending the command, so `g` is the issuing request's.
+    """
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record_call(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        record_call(event.duration_micros / 1e6)
+
+
+class CountingCollection:
+    """
+    Collection proxy that records round trips itself, for drivers that emit
+    no command events (mongomock in the test suite)
+    """
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in COUNTED_METHODS:
+            return attr
+
+        @wraps(attr)
+        def counted(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                record_call(time.perf_counter() - started)
+        return counted
+
+
+def init_app(app):
+    """
+    Reset counters per request and report them as X-DB-Calls / Server-Timing
+    when DB_STATS_HEADERS is enabled
+    """
+    app.config.setdefault('DB_STATS_HEADERS', os.getenv('DB_STATS_HEADERS', 'false').lower() == 'true')
+
+    @app.before_request
+    def reset_db_stats():
+        g.db_stats = [0, 0.0]
+
+    @app.after_request
+    def report_db_stats(response):
+        calls, seconds = g.get('db_stats', (0, 0.0))
+        budget = ROUTE_BUDGETS.get(request.endpoint)
+        if budget is not None:
+            budget += g.get('db_budget_extra', 0)
+        if budget is not None and calls > budget:
+            logger.warning(f"{request.endpoint} made {calls} DB calls (budget {budget})")
+        if app.config['DB_STATS_HEADERS']:
+            response.headers['X-DB-Calls'] = str(calls)
+            response.headers['Server-Timing'] = f'db;dur={seconds * 1000:.2f};desc="{calls} calls"'
+            if budget is not None:
+                response.headers['X-DB-Budget'] = str(budget)
+        return response
+
+
+db_call_counter = DBCallCounter()
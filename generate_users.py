@@ -0,0 +1,199 @@
+"""
+Generate synthetic users for load and scale tests.
+
+The same --seed always produces the same users, and usernames and emails
+are unique across the whole range, so runs can be resumed with --start or
+split across machines. Passwords come from a small pool precomputed with
+bcrypt: user i logs in with f"{password_prefix}{i % hash_pool}".
+
+    python generate_users.py --count 1000000 --workers 8
+    python generate_users.py --count 100000 --target jsonl --output users.jsonl
+    mongoimport --db flask_db --collection users --file users.jsonl
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from bson import json_util
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from models import User, bcrypt
+
+TARGETS = ('mongo', 'mongomock', 'jsonl')
+
+FIRST_NAMES = (
+    'James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William', 'Elizabeth',
+    'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+    'Arjun', 'Priya', 'Wei', 'Mei', 'Hiroshi', 'Yuki', 'Carlos', 'Lucia', 'Ahmed', 'Fatima',
+    'Olga', 'Ivan', 'Kwame', 'Amara', 'Lars', 'Ingrid', 'Mateo', 'Sofia', 'Noah', 'Emma'
+)
+LAST_NAMES = (
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin', 'Lee',
+    'Kumar', 'Sharma', 'Wang', 'Chen', 'Tanaka', 'Sato', 'Silva', 'Santos', 'Khan', 'Ali',
+    'Ivanova', 'Petrov', 'Mensah', 'Okafor', 'Hansen', 'Larsen', 'Rossi', 'Bianchi', 'Muller', 'Schmidt'
+)
+DOMAINS = ('example.com', 'example.org', 'example.net', 'mail.test', 'inbox.test')
+
+# Usernames end in the user's index, which is what keeps them unique
+SEPARATORS = ('.', '_')
+
+# Users are created over the HISTORY_DAYS before EPOCH
+EPOCH = datetime(2025, 1, 1)
+HISTORY_DAYS = 730
+
+# State of each worker process, set by _init_worker
+_worker = {}
+
+
+def hash_pool(size=8, password_prefix='loadtest-', rounds=12):
+    """
+    bcrypt hashes of f"{password_prefix}{k}" for k in range(size)
+    """
+    return [bcrypt.generate_password_hash(f"{password_prefix}{k}", rounds).decode('utf-8')
+            for k in range(size)]
+
+
+def make_user(index, seed, hashes):
+    """
+    User number index for seed: always the same user for the same arguments
+    """
+    rng = random.Random(seed * 1000003 + index)
+    first_name = rng.choice(FIRST_NAMES)
+    last_name = rng.choice(LAST_NAMES)
+    username = f"{first_name}{rng.choice(SEPARATORS)}{last_name}{index}".lower()
+    email = f"{username}@{rng.choice(DOMAINS)}"
+    created_at = EPOCH - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+
+    # Names are optional at registration; leave some profiles sparse
+    if rng.random() < 0.2:
+        first_name = last_name = None
+
+    user = User.user_document(username, email, hashes[index % len(hashes)], first_name, last_name, created_at)
+    age = int((EPOCH - created_at).total_seconds())
+    user['updated_at'] = created_at + timedelta(seconds=rng.randrange(age + 1))
+    login_count = rng.randrange(200)
+    if login_count:
+        user['login_count'] = login_count
+        user['last_login_at'] = created_at + timedelta(seconds=rng.randrange(age + 1))
+    return user
+
+
+def insert_users(collection, users):
+    """
+    Unordered insert_many, returns how many were inserted (users already
+    present from an earlier run are skipped)
+    """
+    try:
+        return len(collection.insert_many(users, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        return e.details['nInserted']
+
+
+def _init_worker(hashes, seed, target, mongo_uri=None, db_name=None, collection_name=None, collection=None):
+    _worker.update(hashes=hashes, seed=seed, target=target)
+    if target == 'mongo':
+        collection = MongoClient(mongo_uri)[db_name][collection_name]
+    _worker['collection'] = collection
+
+
+def _write_batch(bounds):
+    """
+    Build users [start, stop) and insert them, or serialize them for JSONL.
+    Returns (users written, JSONL text or None).
+    """
+    start, stop = bounds
+    users = [make_user(index, _worker['seed'], _worker['hashes']) for index in range(start, stop)]
+    if _worker['target'] == 'jsonl':
+        return len(users), ''.join(json_util.dumps(user) + '\n' for user in users)
+    return insert_users(_worker['collection'], users), None
+
+
+def generate_users(count, target='mongo', seed=0, start=0, batch_size=1000, workers=1, hashes=None,
+                   mongo_uri=None, db_name='flask_db', collection_name='users', collection=None,
+                   output=None, report=print):
+    """
+    Write users start..start+count to the target and return
+    {'written', 'seconds', 'docs_per_second'}.
+
+    mongo: insert with `workers` processes, each with its own client.
+    mongomock: insert into `collection` (a new mongomock collection if not
+    given) in this process. jsonl: write MongoDB extended JSON to `output`.
+    """
+    if target not in TARGETS:
+        raise ValueError(f"Unknown target {target}, expected one of {', '.join(TARGETS)}")
+    if target == 'jsonl' and not output:
+        raise ValueError("The jsonl target needs an output file")
+    if target == 'mongomock':
+        # mongomock data lives in this process only
+        workers = 1
+        if collection is None:
+            import mongomock
+            collection = mongomock.MongoClient()[db_name][collection_name]
+
+    hashes = hashes or hash_pool()
+    init_args = (hashes, seed, target, mongo_uri, db_name, collection_name, collection)
+    batches = [(low, min(low + batch_size, start + count)) for low in range(start, start + count, batch_size)]
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=init_args)
+        results = pool.imap(_write_batch, batches)  # in order, so JSONL output is deterministic
+    else:
+        _init_worker(*init_args)
+        results = map(_write_batch, batches)
+
+    written = 0
+    started = last_report = time.perf_counter()
+    out = open(output, 'w') if target == 'jsonl' else None
+    try:
+        for batch_written, text in results:
+            written += batch_written
+            if out is not None:
+                out.write(text)
+            now = time.perf_counter()
+            if report and now - last_report >= 1:
+                report(f"{written:,}/{count:,} users, {written / (now - started):,.0f} docs/s")
+                last_report = now
+    finally:
+        if out is not None:
+            out.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    seconds = time.perf_counter() - started
+    stats = {'written': written, 'seconds': seconds, 'docs_per_second': written / seconds if seconds else 0.0}
+    if report:
+        report(f"Wrote {written:,} users in {seconds:.1f}s ({stats['docs_per_second']:,.0f} docs/s)")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic users for load and scale tests")
+    parser.add_argument('--count', type=int, required=True, help="number of users to generate")
+    parser.add_argument('--target', choices=TARGETS, default='mongo')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', type=int, default=0, help="index of the first user (resume or split runs)")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--hash-pool', type=int, default=8, help="distinct password hashes to reuse")
+    parser.add_argument('--password-prefix', default='loadtest-')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--db', default=os.getenv('MONGO_DB_NAME', 'flask_db'))
+    parser.add_argument('--collection', default='users')
+    parser.add_argument('--output', help="file for the jsonl target")
+    args = parser.parse_args(argv)
+
+    hashes = hash_pool(args.hash_pool, args.password_prefix, args.bcrypt_rounds)
+    generate_users(args.count, target=args.target, seed=args.seed, start=args.start,
+                   batch_size=args.batch_size, workers=args.workers, hashes=hashes,
+                   mongo_uri=args.mongo_uri, db_name=args.db, collection_name=args.collection,
+                   output=args.output)
+
+
+if __name__ == '__main__':
+    main()
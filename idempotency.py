@@ -0,0 +1,160 @@
+import hashlib
+import hmac
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, request, jsonify
+from flask_jwt_extended import get_jwt_identity
+from pymongo.errors import DuplicateKeyError
+from cache import TTLCache
+from config import db
+from dbstats import extend_budget
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# How long a duplicate waits for the first request to finish before a 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', 5))
+
+# A request still in_progress after this long is presumed dead (crashed
+# worker) and its key may be claimed by a retry; keep it above every route
+# deadline
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv('IDEMPOTENCY_LEASE_SECONDS', 60))
+
+# Round trips a keyed request adds to its route's budget: stored response
+# lookup + claim + completion
+IDEMPOTENCY_DB_CALLS = 3
+
+# Completed responses served from memory without a Mongo lookup
+response_cache = TTLCache(
+    maxsize=int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('IDEMPOTENCY_CACHE_TTL', 300))
+)
+
+
+def _replay(stored):
+    response = jsonify(stored['body'])
+    response.status_code = stored['status']
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _fingerprint():
+    """
+    HMAC of the request body: bodies carry passwords, so a plain hash stored
+    in Mongo could be brute-forced back to them
+    """
+    secret = os.getenv('IDEMPOTENCY_SECRET') or current_app.config['JWT_SECRET_KEY']
+    return hmac.new(secret.encode('utf-8'), request.get_data(), hashlib.sha256).hexdigest()
+
+
+def _claim(key, fingerprint):
+    """
+    Become the owner of key: insert it, or take over an in_progress claim
+    whose lease ran out. Returns the claim id, or None if someone else owns it.
+    """
+    claim = uuid.uuid4().hex
+    now = datetime.utcnow()
+    lease_until = now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+    try:
+        db.idempotency_keys.insert_one({
+            '_id': key,
+            'status': 'in_progress',
+            'fingerprint': fingerprint,
+            'claim': claim,
+            'lease_until': lease_until,
+            'created_at': now
+        })
+        return claim
+    except DuplicateKeyError:
+        pass
+    result = db.idempotency_keys.update_one(
+        {'_id': key, 'status': 'in_progress', 'lease_until': {'$lt': now}},
+        {'$set': {'fingerprint': fingerprint, 'claim': claim, 'lease_until': lease_until}}
+    )
+    if result.modified_count:
+        logger.warning(f"Reclaimed idempotency key {key} after its lease expired")
+        return claim
+    return None
+
+
+def _completed(key, fingerprint):
+    """
+    Stored response for key, or a 422 response if the key was used for a
+    different request, or None while the first request is still running
+    """
+    stored = response_cache.get(key)
+    if stored is None:
+        record = db.idempotency_keys.find_one({'_id': key})
+        if record is None or record['status'] != 'completed':
+            return None
+        stored = {'fingerprint': record['fingerprint'], 'status': record['response_status'],
+                  'body': record['response_body']}
+        response_cache.set(key, stored)
+    if stored['fingerprint'] != fingerprint:
+        return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+    return _replay(stored)
+
+
+def idempotent(per_user=False):
+    """
+    Honour an Idempotency-Key header: the first response for a key is stored
+    (hot cache + TTL-indexed idempotency_keys collection) and replayed for
+    retries instead of running the view again. 5xx responses are not stored.
+    A claim whose request never finished is retried after its lease expires.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            header = request.headers.get(IDEMPOTENCY_HEADER)
+            if not header:
+                return view(*args, **kwargs)
+            extend_budget(IDEMPOTENCY_DB_CALLS)
+
+            owner = get_jwt_identity() if per_user else ''
+            key = f"{request.path}:{owner}:{header}"
+            fingerprint = _fingerprint()
+
+            replay = _completed(key, fingerprint)
+            if replay is not None:
+                return replay
+
+            # Claim the key; the unique _id makes exactly one request the owner
+            claim = _claim(key, fingerprint)
+            if claim is None:
+                deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+                delay = 0.05
+                while time.monotonic() < deadline:
+                    replay = _completed(key, fingerprint)
+                    if replay is not None:
+                        return replay
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.5)
+                return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+
+            try:
+                response = view(*args, **kwargs)
+            except Exception:
+                db.idempotency_keys.delete_one({'_id': key, 'claim': claim})
+                raise
+
+            body, status = response if isinstance(response, tuple) else (response, None)
+            status = status or body.status_code
+            if status >= 500:
+                # Let the client retry failures for real
+                db.idempotency_keys.delete_one({'_id': key, 'claim': claim})
+                return response
+
+            stored = {'fingerprint': fingerprint, 'status': status, 'body': body.get_json()}
+            db.idempotency_keys.update_one({'_id': key, 'claim': claim}, {
+                '$set': {'status': 'completed', 'response_status': status, 'response_body': stored['body']},
+                '$unset': {'lease_until': ''}
+            })
+            response_cache.set(key, stored)
+            return response
+        return wrapper
+    return decorator
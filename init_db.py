@@ -1,4 +1,6 @@
 from config import client, db
+from partitioning import PartitionedDatabase
+import os
 
 def init_database():
     """
@@ -13,6 +15,47 @@ def init_database():
     # Create unique index on email
     users_collection.create_index('email', unique=True)
     
+    # Normalized copies for case-insensitive prefix search (backfill old users)
+    users_collection.update_many(
+        {'username_lower': {'$exists': False}},
+        [{'$set': {'username_lower': {'$toLower': '$username'}, 'email_lower': {'$toLower': '$email'}}}]
+    )
+    users_collection.create_index([('username_lower', 1), ('_id', 1)])
+    users_collection.create_index([('email_lower', 1), ('_id', 1)])
+    
+    # Change feed order: GET /users/changes resumes from (updated_at, _id)
+    users_collection.create_index([('updated_at', 1), ('_id', 1)])
+    
+    # Partitioned users: emails are reserved in a shared index (see partitioning.py)
+    if isinstance(db, PartitionedDatabase):
+        db.user_emails.create_index('user_id')
+        duplicates = db.backfill_email_index()
+        if duplicates:
+            print(f"Emails held by more than one user: {', '.join(duplicates)}")
+    
+    # Refresh tokens: look up by user for revocation, expire with the token
+    db.refresh_tokens.create_index('user_id')
+    db.refresh_tokens.create_index('expires_at', expireAfterSeconds=0)
+    
+    # Idempotency keys: stored responses expire after IDEMPOTENCY_KEY_TTL_HOURS
+    ttl_hours = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    db.idempotency_keys.create_index('created_at', expireAfterSeconds=ttl_hours * 3600)
+    
+    # Profile changes shared between workers (PROFILE_CLAIMS): polled by time,
+    # dropped once every token issued before them has expired
+    db.profile_changes.create_index('changed_at')
+    db.profile_changes.create_index('expires_at', expireAfterSeconds=0)
+    
+    # Queued registrations: claimed oldest first; only finished jobs expire
+    # (finished_at is unset while a job is queued or processing)
+    db.registration_jobs.create_index([('status', 1), ('created_at', 1)])
+    db.registration_jobs.create_index('claim')
+    if 'created_at_1' in db.registration_jobs.index_information():
+        # Earlier versions expired jobs by created_at, unfinished ones included
+        db.registration_jobs.drop_index('created_at_1')
+    job_ttl_hours = int(os.getenv('REGISTRATION_JOB_TTL_HOURS', 24))
+    db.registration_jobs.create_index('finished_at', expireAfterSeconds=job_ttl_hours * 3600)
+    
     print("Database initialized successfully!")
 
 if __name__ == '__main__':
@@ -1,36 +1,167 @@
 from flask_bcrypt import Bcrypt
-from datetime import datetime
+from datetime import datetime, timedelta
+import base64
+import json
+import os
+import threading
+import time
 from bson.objectid import ObjectId
-import re
+from bson.errors import InvalidId
+from validation import EMAIL_REGEX, validators
+from bloom import availability_filter
+from activity import login_activity
+from singleflight import SingleFlight
+from cache import TTLCache
 
 bcrypt = Bcrypt()
 
+# Fields clients may read from a profile (never password_hash)
+PROFILE_FIELDS = ('_id', 'username', 'email', 'first_name', 'last_name', 'created_at', 'updated_at',
+                  'last_login_at', 'login_count')
+
+
+# Fields returned by user search results
+SEARCH_FIELDS = ('_id', 'username', 'email', 'first_name', 'last_name')
+
+# Normalized copies of username/email that prefix search runs against
+SEARCH_KEYS = {'username': 'username_lower', 'email': 'email_lower'}
+
+
+def prefix_upper_bound(prefix):
+    """
+    Smallest string greater than every string starting with prefix
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def encode_cursor(key, user_id):
+    return base64.urlsafe_b64encode(json.dumps([key, str(user_id)]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        key, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return key, ObjectId(user_id)
+    except (ValueError, TypeError, InvalidId):
+        raise ValueError("Invalid cursor")
+
+
+# Concurrent reads of the same user share one find_one
+user_lookups = SingleFlight()
+
+# Public profiles recently read by User.get_users_by_ids; dropped on local
+# writes, and kept briefly so other processes' edits show up soon
+profile_cache = TTLCache(
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', 5))
+)
+
+# Wakes long-polling change feed readers when this process writes a user
+user_changes = threading.Condition()
+
+
+def notify_user_changed():
+    with user_changes:
+        user_changes.notify_all()
+
+
+class UserRecord:
+    """
+    Compact user record: the one place a Mongo document is decoded and the
+    one place a user is encoded for JSON responses
+    """
+    __slots__ = ('id', 'username', 'email', 'password_hash', 'first_name', 'last_name',
+                 'created_at', 'updated_at', 'last_login_at', 'login_count')
+
+    def __init__(self, id=None, username=None, email=None, password_hash=None,
+                 first_name=None, last_name=None, created_at=None, updated_at=None,
+                 last_login_at=None, login_count=None):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.password_hash = password_hash
+        self.first_name = first_name
+        self.last_name = last_name
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.last_login_at = last_login_at
+        self.login_count = login_count
+
+    @classmethod
+    def from_bson(cls, doc):
+        """
+        Decode a users document (full or projected); unknown keys are dropped
+        """
+        if doc is None:
+            return None
+        get = doc.get
+        return cls(get('_id'), get('username'), get('email'), get('password_hash'),
+                   get('first_name'), get('last_name'), get('created_at'), get('updated_at'),
+                   get('last_login_at'), get('login_count'))
+
+    def to_json(self, fields=PROFILE_FIELDS):
+        """
+        Encode the public profile fields for jsonify
+        """
+        return {
+            field: (str(self.id) if self.id is not None else None) if field == '_id' else getattr(self, field)
+            for field in fields
+        }
+
+    def __repr__(self):
+        return f"<UserRecord {self.id} {self.username}>"
+
+
 class User:
     """
     User model for MongoDB
     """
+    PROFILE_FIELDS = PROFILE_FIELDS
+
+    @staticmethod
+    def profile_fields(fields=None):
+        """
+        Parse a comma separated ?fields= value against PROFILE_FIELDS
+        """
+        if not fields:
+            return PROFILE_FIELDS
+        
+        requested = tuple(f.strip() for f in fields.split(',') if f.strip())
+        unknown = [f for f in requested if f not in PROFILE_FIELDS]
+        if unknown or not requested:
+            raise ValueError(f"Unknown profile fields: {', '.join(unknown) or fields}")
+        return requested
+
+    @staticmethod
+    def profile_projection(fields=PROFILE_FIELDS):
+        """
+        Build the Mongo projection that reads only the given profile fields
+        """
+        projection = {f: 1 for f in fields}
+        # _id is returned by Mongo unless excluded explicitly
+        projection.setdefault('_id', 0)
+        return projection
+
     @staticmethod
     def validate_email(email):
         """
         Validate email format
         """
-        email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(email_regex, email) is not None
+        return isinstance(email, str) and EMAIL_REGEX.match(email) is not None
 
     @staticmethod
     def create_user(mongo_db, username, email, password, first_name=None, last_name=None):
         """
         Create a new user in the database
         """
-        # Validate inputs
-        if not username or len(username) < 3:
-            raise ValueError("Username must be at least 3 characters long")
-        
-        if not User.validate_email(email):
-            raise ValueError("Invalid email format")
-        
-        if not password or len(password) < 6:
-            raise ValueError("Password must be at least 6 characters long")
+        # Validate inputs against the UserRegistration schema (raises ValidationError)
+        validators['UserRegistration']({
+            'username': username,
+            'email': email,
+            'password': password,
+            'first_name': first_name,
+            'last_name': last_name
+        })
 
         # Check if username or email already exists
         existing_user = mongo_db.users.find_one({
@@ -43,57 +174,181 @@ class User:
         if existing_user:
             raise ValueError("Username or email already exists")
 
+        # Insert user and return the inserted ID
+        user_doc = User.new_user_document(username, email, password, first_name, last_name)
+        result = mongo_db.users.insert_one(user_doc)
+        availability_filter.add(username, email)
+        notify_user_changed()
+        return result.inserted_id
+
+    @staticmethod
+    def new_user_document(username, email, password, first_name=None, last_name=None):
+        """
+        Build a user document for already validated input, hashing the password
+        """
         # Hash the password
         hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        return User.user_document(username, email, hashed_password, first_name, last_name)
 
-        # Prepare user document
-        user_doc = {
+    @staticmethod
+    def user_document(username, email, password_hash, first_name=None, last_name=None, created_at=None):
+        """
+        The stored shape of a user
+        """
+        created_at = created_at or datetime.utcnow()
+        return {
             'username': username,
             'email': email,
-            'password_hash': hashed_password,
+            'password_hash': password_hash,
             'first_name': first_name,
             'last_name': last_name,
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow()
+            'username_lower': username.lower(),
+            'email_lower': email.lower(),
+            'created_at': created_at,
+            'updated_at': created_at
         }
 
-        # Insert user and return the inserted ID
-        result = mongo_db.users.insert_one(user_doc)
-        return result.inserted_id
+    @staticmethod
+    def is_available(mongo_db, field, value):
+        """
+        Check whether a username or email is free. The bloom filter answers
+        "definitely free" without a query; only possible hits go to Mongo.
+        """
+        maybe_taken = (availability_filter.username_maybe_taken if field == 'username'
+                       else availability_filter.email_maybe_taken)
+        if not maybe_taken(value):
+            return True
+        return mongo_db.users.find_one({field: value}, {'_id': 1}) is None
 
     @staticmethod
     def authenticate(mongo_db, username, password):
         """
         Authenticate user
         """
-        user = mongo_db.users.find_one({'username': username})
+        user = UserRecord.from_bson(mongo_db.users.find_one({'username': username}))
         
-        if user and bcrypt.check_password_hash(user['password_hash'], password):
+        if user and bcrypt.check_password_hash(user.password_hash, password):
+            # Written behind in batches, not per login
+            login_activity.record(user.id)
             return user
         
         return None
 
     @staticmethod
-    def get_user_by_id(mongo_db, user_id):
+    def get_user_by_id(mongo_db, user_id, fields=PROFILE_FIELDS, coalesce=True):
         """
-        Get user by MongoDB ObjectId
+        Get user by MongoDB ObjectId, reading only the given profile fields.
+        Concurrent identical lookups share one query unless coalesce is off
+        (needed to read back a write the caller just made).
         """
         try:
             # Convert string to ObjectId if needed
             if isinstance(user_id, str):
                 user_id = ObjectId(user_id)
-            
-            user = mongo_db.users.find_one({'_id': user_id})
-            
-            if user:
-                # Remove sensitive information and convert _id to string
-                user.pop('password_hash', None)
-                user['_id'] = str(user['_id'])
-                return user
-            
-            return None
-        except Exception:
+        except InvalidId:
             return None
+        
+        def lookup():
+            user = mongo_db.users.find_one({'_id': user_id}, User.profile_projection(fields))
+            return UserRecord.from_bson(user)
+        
+        if not coalesce:
+            return lookup()
+        return user_lookups.do((id(mongo_db), user_id, tuple(fields)), lookup)
+
+    @staticmethod
+    def get_users_by_ids(mongo_db, user_ids):
+        """
+        Public profiles for many ObjectIds. Cached profiles are used first and
+        the rest are read with a single $in query. Returns {id: UserRecord}
+        for the ids that exist.
+        """
+        found = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            cached = profile_cache.get(user_id)
+            if cached is not None:
+                found[user_id] = cached
+            else:
+                missing.append(user_id)
+        
+        if missing:
+            docs = mongo_db.users.find({'_id': {'$in': missing}}, User.profile_projection(PROFILE_FIELDS))
+            for doc in docs:
+                user = UserRecord.from_bson(doc)
+                found[user.id] = user
+                profile_cache.set(user.id, user)
+        return found
+
+    @staticmethod
+    def search(mongo_db, prefix, field='username', limit=10, after=None):
+        """
+        Case-insensitive prefix search on username or email, ordered by the
+        normalized key and keyset paginated. The prefix becomes an index
+        range on username_lower/email_lower, so no collection scan happens.
+        Returns (records, next_cursor).
+        """
+        key = SEARCH_KEYS[field]
+        prefix = prefix.lower()
+        query = {key: {'$gte': prefix, '$lt': prefix_upper_bound(prefix)}}
+        
+        if after:
+            after_key, after_id = decode_cursor(after)
+            query = {'$and': [query, {'$or': [
+                {key: {'$gt': after_key}},
+                {key: after_key, '_id': {'$gt': after_id}}
+            ]}]}
+        
+        projection = dict(User.profile_projection(SEARCH_FIELDS), **{key: 1})
+        # Fetch one extra row to know whether there is a next page
+        docs = list(mongo_db.users.find(query, projection, sort=[(key, 1), ('_id', 1)], limit=limit + 1))
+        
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(docs[-1][key], docs[-1]['_id'])
+        
+        return [UserRecord.from_bson(doc) for doc in docs], next_cursor
+
+    @staticmethod
+    def changes(mongo_db, since=None, limit=100, wait=0, settle=0):
+        """
+        Users modified after the since cursor, ordered by (updated_at, _id) on
+        the matching index. Changes younger than settle seconds are held back
+        so a write that committed late with an earlier updated_at is not
+        skipped. With wait, an empty result is retried until a change arrives
+        or wait seconds pass. Returns (records, next_cursor, has_more).
+        """
+        # Every user written by the app has updated_at
+        query = {'updated_at': {'$ne': None}}
+        if since:
+            since_key, since_id = decode_cursor(since)
+            try:
+                since_key = datetime.fromisoformat(since_key)
+            except (ValueError, TypeError):
+                raise ValueError("Invalid cursor")
+            query = {'$or': [
+                {'updated_at': {'$gt': since_key}},
+                {'updated_at': since_key, '_id': {'$gt': since_id}}
+            ]}
+        
+        projection = User.profile_projection(PROFILE_FIELDS)
+        deadline = time.monotonic() + wait
+        while True:
+            settled = {'updated_at': {'$lte': datetime.utcnow() - timedelta(seconds=settle)}}
+            # Fetch one extra row to know whether there is more to read
+            docs = list(mongo_db.users.find({'$and': [query, settled]}, projection,
+                                            sort=[('updated_at', 1), ('_id', 1)], limit=limit + 1))
+            remaining = deadline - time.monotonic()
+            if docs or remaining <= 0:
+                break
+            with user_changes:
+                user_changes.wait(min(remaining, max(settle, 0.5)))
+        
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]['updated_at'].isoformat(), docs[-1]['_id']) if docs else since
+        return [UserRecord.from_bson(doc) for doc in docs], next_cursor, has_more
 
     @staticmethod
     def update_user(mongo_db, user_id, update_data):
@@ -119,6 +374,8 @@ class User:
             
             # Update user
             result = mongo_db.users.update_one({'_id': user_id}, update_doc)
+            profile_cache.pop(user_id)
+            notify_user_changed()
             
             return result.modified_count > 0
         except Exception:
@@ -135,10 +392,10 @@ class User:
                 user_id = ObjectId(user_id)
             
             # Find user
-            user = mongo_db.users.find_one({'_id': user_id})
+            user = UserRecord.from_bson(mongo_db.users.find_one({'_id': user_id}, {'password_hash': 1}))
             
             # Verify current password
-            if not user or not bcrypt.check_password_hash(user['password_hash'], current_password):
+            if not user or not bcrypt.check_password_hash(user.password_hash, current_password):
                 return False
             
             # Hash new password
@@ -152,7 +409,72 @@ class User:
                     'updated_at': datetime.utcnow()
                 }}
             )
+            profile_cache.pop(user_id)
+            notify_user_changed()
             
             return result.modified_count > 0
         except Exception:
-            return False 
\ No newline at end of file
+            return False
+
+
+class RefreshToken:
+    """
+    Refresh token state for rotation and revocation, keyed by the token's jti
+    """
+    @staticmethod
+    def store(mongo_db, jti, user_id, expires_at):
+        """
+        Record a newly issued refresh token
+        """
+        mongo_db.refresh_tokens.insert_one({
+            '_id': jti,
+            'user_id': str(user_id),
+            'revoked': False,
+            'replaced_by': None,
+            'created_at': datetime.utcnow(),
+            'expires_at': expires_at
+        })
+
+    @staticmethod
+    def is_revoked(mongo_db, jti):
+        """
+        Check a presented refresh token. Replaying a token that was already
+        rotated means it leaked, so every token of that user is revoked.
+        """
+        token = mongo_db.refresh_tokens.find_one({'_id': jti})
+        if not token:
+            return True
+        if token['revoked'] and token.get('replaced_by'):
+            RefreshToken.revoke_all(mongo_db, token['user_id'])
+        return token['revoked']
+
+    @staticmethod
+    def rotate(mongo_db, jti, new_jti):
+        """
+        Atomically retire a refresh token in favour of new_jti.
+        Returns False if it was already used or revoked.
+        """
+        result = mongo_db.refresh_tokens.update_one(
+            {'_id': jti, 'revoked': False},
+            {'$set': {'revoked': True, 'replaced_by': new_jti}}
+        )
+        return result.modified_count > 0
+
+    @staticmethod
+    def revoke(mongo_db, jti):
+        """
+        Revoke a single refresh token
+        """
+        result = mongo_db.refresh_tokens.update_one({'_id': jti}, {'$set': {'revoked': True}})
+        return result.matched_count > 0
+
+    @staticmethod
+    def revoke_all(mongo_db, user_id):
+        """
+        Revoke every refresh token of a user
+        """
+        result = mongo_db.refresh_tokens.update_many(
+            {'user_id': str(user_id), 'revoked': False},
+            {'$set': {'revoked': True}}
+        )
+        return result.modified_count
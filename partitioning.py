@@ -0,0 +1,435 @@
+import logging
+import time
+import zlib
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from pymongo.results import BulkWriteResult, InsertManyResult
+
+logger = logging.getLogger(__name__)
+
+# Number of virtual slots usernames hash into. Partitions own slots, so
+# rebalancing moves whole slots instead of rehashing every user.
+SLOT_COUNT = 1024
+
+# Field stored on every partitioned user so a slot can be moved in one query
+SLOT_FIELD = 'partition_slot'
+
+# Collections on the first partition shared by every process: the slot map,
+# and every user's email (unique indexes only hold within one partition)
+MAP_COLLECTION = 'partition_map'
+MAP_ID = 'users'
+EMAIL_INDEX_COLLECTION = 'user_emails'
+
+# A reservation this old whose user does not exist was left by a failed insert
+STALE_RESERVATION = timedelta(seconds=60)
+
+# Rebalance rounds per slot; each moves what changed during the previous one
+MAX_MOVE_ROUNDS = 5
+DELETE_CHUNK = 500
+
+# Counters summed across the partitions of one bulk_write
+BULK_COUNTS = ('nInserted', 'nUpserted', 'nMatched', 'nModified', 'nRemoved')
+
+
+def slot_for_username(username):
+    """
+    Stable hash of a username into a slot (unlike hash(), same across processes)
+    """
+    return zlib.crc32(username.encode('utf-8')) % SLOT_COUNT
+
+
+def new_object_id(slot):
+    """
+    Generate an ObjectId with the slot encoded in bytes 7-8 of its random part
+    """
+    raw = bytearray(ObjectId().binary)
+    raw[7:9] = slot.to_bytes(2, 'big')
+    return ObjectId(bytes(raw))
+
+
+def slot_for_object_id(user_id):
+    """
+    Read the slot back out of a user id, or None if it cannot hold one
+    """
+    if isinstance(user_id, str):
+        if not ObjectId.is_valid(user_id):
+            return None
+        user_id = ObjectId(user_id)
+    if not isinstance(user_id, ObjectId):
+        return None
+    slot = int.from_bytes(user_id.binary[7:9], 'big')
+    return slot if slot < SLOT_COUNT else None
+
+
+class UserRouter:
+    """
+    Maps slots to partition databases. The slot map lives in the
+    partition_map collection of the first partition so every process routes
+    alike: it is created there on first use (slot % partitions, or slot_map)
+    and re-read every refresh_interval seconds, so adding a partition URI
+    changes nothing until a rebalance, and a rebalance reaches every worker.
+    """
+    def __init__(self, databases, slot_map=None, refresh_interval=5.0):
+        if not databases:
+            raise ValueError("At least one partition database is required")
+        self.databases = list(databases)
+        self.refresh_interval = refresh_interval
+        self._initial_map = list(slot_map) if slot_map else [
+            slot % len(self.databases) for slot in range(SLOT_COUNT)
+        ]
+        self._check_slot_map(self._initial_map)
+        self._slot_map = None
+        self._version = 0
+        self._loaded_at = 0.0
+
+    def _check_slot_map(self, slot_map):
+        if len(slot_map) != SLOT_COUNT:
+            raise ValueError(f"Slot map must have {SLOT_COUNT} entries")
+        if any(p < 0 or p >= len(self.databases) for p in slot_map):
+            raise ValueError("Slot map refers to an unknown partition "
+                             f"(only {len(self.databases)} configured, was one removed?)")
+
+    @property
+    def map_collection(self):
+        return self.databases[0][MAP_COLLECTION]
+
+    @property
+    def slot_map(self):
+        if self._slot_map is None or time.monotonic() - self._loaded_at >= self.refresh_interval:
+            try:
+                self.refresh()
+            except PyMongoError as e:
+                if self._slot_map is None:
+                    raise
+                logger.warning(f"Could not refresh the partition slot map, keeping version {self._version}: {e}")
+        return self._slot_map
+
+    def refresh(self):
+        """
+        Load the shared slot map, creating it if this is the first process
+        """
+        stored = self.map_collection.find_one({'_id': MAP_ID})
+        if stored is None:
+            stored = {'_id': MAP_ID, 'slots': self._initial_map, 'version': 1}
+            try:
+                self.map_collection.insert_one(dict(stored))
+            except DuplicateKeyError:
+                stored = self.map_collection.find_one({'_id': MAP_ID})
+        self._check_slot_map(stored['slots'])
+        self._slot_map = list(stored['slots'])
+        self._version = stored['version']
+        self._loaded_at = time.monotonic()
+
+    def database_for_slot(self, slot):
+        return self.databases[self.slot_map[slot]]
+
+    def database_for_username(self, username):
+        return self.database_for_slot(slot_for_username(username))
+
+    def database_for_id(self, user_id):
+        slot = slot_for_object_id(user_id)
+        return None if slot is None else self.database_for_slot(slot)
+
+    def rebalance(self, slot_map, collection='users', settle_seconds=None):
+        """
+        Publish slot_map, wait settle_seconds (default refresh_interval) for
+        every process to route writes by it, then move each slot whose owner
+        changed. Returns the number of documents moved.
+        """
+        self._check_slot_map(slot_map)
+        self.refresh()
+        old_map = list(self._slot_map)
+        result = self.map_collection.update_one(
+            {'_id': MAP_ID, 'version': self._version},
+            {'$set': {'slots': list(slot_map), 'version': self._version + 1}}
+        )
+        if not result.matched_count:
+            raise RuntimeError("The slot map changed during the rebalance, run it again")
+        self.refresh()
+
+        settle_seconds = self.refresh_interval if settle_seconds is None else settle_seconds
+        if settle_seconds:
+            time.sleep(settle_seconds)
+
+        moved = 0
+        for slot, (old, new) in enumerate(zip(old_map, slot_map)):
+            if old != new:
+                moved += self._move_slot(slot, self.databases[old][collection], self.databases[new][collection])
+        return moved
+
+    def _move_slot(self, slot, source, target):
+        """
+        Copy a slot's documents to target, then delete from source only the
+        documents still identical to what was copied. Anything written to
+        source in between is left there and moved by the next round.
+        """
+        moved = 0
+        for _ in range(MAX_MOVE_ROUNDS):
+            docs = list(source.find({SLOT_FIELD: slot}))
+            if not docs:
+                return moved
+            try:
+                target.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # Copied by an earlier round or run: overwrite with the current version
+                for error in e.details.get('writeErrors', []):
+                    doc = docs[error['index']]
+                    target.replace_one({'_id': doc['_id']}, doc, upsert=True)
+            for start in range(0, len(docs), DELETE_CHUNK):
+                result = source.delete_many({'$or': docs[start:start + DELETE_CHUNK]})
+                moved += result.deleted_count
+        logger.warning(f"Slot {slot} still had writes after {MAX_MOVE_ROUNDS} rounds, run the rebalance again")
+        return moved
+
+
+def _touched(result):
+    """
+    Whether an update/delete result matched a document
+    """
+    return getattr(result, 'matched_count', 0) or getattr(result, 'deleted_count', 0)
+
+
+class PartitionedCollection:
+    """
+    Drop-in for the users collection that routes each operation to the
+    partition(s) its filter allows, falling back to querying every partition
+    """
+    def __init__(self, router, name='users'):
+        self.router = router
+        self.name = name
+
+    def _collections(self):
+        return [database[self.name] for database in self.router.databases]
+
+    def _candidates(self, query):
+        """
+        Collections to try for a filter, most likely first. A username or id
+        points at its slot's owner; the other partitions are tried after it,
+        as a slot's users stay on the old owner until a rebalance moves them.
+        """
+        collections = self._collections()
+        if not query:
+            return collections
+        username = query.get('username')
+        if isinstance(username, str):
+            slot = slot_for_username(username)
+        else:
+            slot = slot_for_object_id(query.get('_id'))
+        if slot is not None:
+            first = collections.pop(self.router.slot_map[slot])
+            return [first] + collections
+        return collections
+
+    def _prepare(self, document):
+        """
+        Stamp a new user with its slot (and a slot-encoded id), return its partition
+        """
+        slot = slot_for_username(document['username'])
+        document.setdefault('_id', new_object_id(slot))
+        document[SLOT_FIELD] = slot
+        return self.router.slot_map[slot]
+
+    def _emails(self):
+        return self.router.databases[0][EMAIL_INDEX_COLLECTION]
+
+    def _reserve_email(self, document):
+        """
+        Claim the user's email in the global index, raising DuplicateKeyError
+        if another user holds it
+        """
+        if document.get('email') is None:
+            return
+        reservation = {'_id': document['email'], 'user_id': document['_id'], 'created_at': datetime.utcnow()}
+        try:
+            self._emails().insert_one(reservation)
+        except DuplicateKeyError:
+            # Take over a reservation left by an insert that never completed
+            held = self._emails().find_one({'_id': document['email']})
+            if (held is None or held['created_at'] > datetime.utcnow() - STALE_RESERVATION
+                    or self.find_one({'_id': held['user_id']}, {'_id': 1}) is not None):
+                raise
+            if not self._emails().replace_one(held, reservation).matched_count:
+                raise
+
+    def _release_emails(self, user_ids):
+        if user_ids:
+            self._emails().delete_many({'user_id': {'$in': list(user_ids)}})
+
+    def insert_one(self, document, *args, **kwargs):
+        partition = self._prepare(document)
+        self._reserve_email(document)
+        try:
+            return self._collections()[partition].insert_one(document, *args, **kwargs)
+        except Exception:
+            self._release_emails([document['_id']])
+            raise
+
+    def insert_many(self, documents, *args, **kwargs):
+        """
+        All or nothing across partitions: a clashing email fails the whole
+        call before any user is written
+        """
+        batches = {}
+        reserved = []
+        try:
+            for document in documents:
+                partition = self._prepare(document)
+                self._reserve_email(document)
+                reserved.append(document['_id'])
+                batches.setdefault(partition, []).append(document)
+        except DuplicateKeyError:
+            self._release_emails(reserved)
+            raise
+        collections = self._collections()
+        inserted_ids = []
+        for partition, batch in batches.items():
+            inserted_ids.extend(collections[partition].insert_many(batch, *args, **kwargs).inserted_ids)
+        return InsertManyResult(inserted_ids, True)
+
+    def find_one(self, query=None, *args, **kwargs):
+        for collection in self._candidates(query):
+            found = collection.find_one(query, *args, **kwargs)
+            if found is not None:
+                return found
+        return None
+
+    def find(self, query=None, *args, sort=None, limit=0, **kwargs):
+        """
+        Single partition filters return a normal cursor. Fan-out queries are
+        merged in memory, so sort and limit must be passed as arguments.
+        """
+        candidates = self._candidates(query)
+        if len(candidates) == 1:
+            return candidates[0].find(query, *args, sort=sort, limit=limit, **kwargs)
+        docs = [doc for c in candidates for doc in c.find(query, *args, sort=sort, limit=limit, **kwargs)]
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        return docs[:limit] if limit else docs
+
+    def _write_one(self, method, query, *args, **kwargs):
+        result = None
+        for collection in self._candidates(query):
+            result = getattr(collection, method)(query, *args, **kwargs)
+            if _touched(result):
+                return result
+        return result
+
+    def update_one(self, query, update, *args, **kwargs):
+        return self._write_one('update_one', query, update, *args, **kwargs)
+
+    def delete_one(self, query, *args, **kwargs):
+        doc = self.find_one(query, {'_id': 1})
+        if doc is None:
+            return self._write_one('delete_one', query, *args, **kwargs)
+        result = self._write_one('delete_one', dict(query, _id=doc['_id']), *args, **kwargs)
+        self._release_emails([doc['_id']])
+        return result
+
+    def update_many(self, query, update, *args, **kwargs):
+        return [c.update_many(query, update, *args, **kwargs) for c in self._collections()]
+
+    def delete_many(self, query, *args, **kwargs):
+        ids = [doc['_id'] for doc in self.find(query, {'_id': 1})]
+        results = [c.delete_many(query, *args, **kwargs) for c in self._collections()]
+        self._release_emails(ids)
+        return results
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        """
+        Split single-document write operations by the partition their filter
+        points at (the operation's filter is read from pymongo's _filter).
+        Every partition's batch runs even if another one fails, so ordered
+        only holds within a partition; a BulkWriteError lists failed
+        operations by their position in requests.
+        """
+        batches = {}
+        for index, operation in enumerate(requests):
+            target = self._candidates(getattr(operation, '_filter', None))[0]
+            batch = batches.setdefault(id(target), (target, [], []))
+            batch[1].append(operation)
+            batch[2].append(index)
+
+        totals = dict.fromkeys(BULK_COUNTS, 0)
+        totals.update(upserted=[], writeErrors=[], writeConcernErrors=[])
+        for target, operations, positions in batches.values():
+            try:
+                details = target.bulk_write(operations, ordered=ordered, **kwargs).bulk_api_result
+            except BulkWriteError as e:
+                details = e.details
+            except PyMongoError as e:
+                # The partition is unreachable: count all of its operations as failed
+                details = {'writeErrors': [{'index': i, 'code': getattr(e, 'code', None), 'errmsg': str(e)}
+                                           for i in range(len(operations))]}
+            for key in BULK_COUNTS:
+                totals[key] += details.get(key, 0)
+            for key in ('upserted', 'writeErrors'):
+                totals[key].extend(dict(entry, index=positions[entry['index']]) for entry in details.get(key, []))
+            totals['writeConcernErrors'].extend(details.get('writeConcernErrors', []))
+
+        if totals['writeErrors'] or totals['writeConcernErrors']:
+            totals['writeErrors'].sort(key=lambda error: error['index'])
+            raise BulkWriteError(totals)
+        return BulkWriteResult(totals, True)
+
+    def count_documents(self, query, *args, **kwargs):
+        return sum(c.count_documents(query, *args, **kwargs) for c in self._collections())
+
+    def create_index(self, *args, **kwargs):
+        names = [c.create_index(*args, **kwargs) for c in self._collections()]
+        return names[0]
+
+
+class PartitionedDatabase:
+    """
+    Stands in for config.db: `users` is partitioned, every other collection
+    lives on the first partition
+    """
+    def __init__(self, router):
+        self.router = router
+        self.users = PartitionedCollection(router)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.router.databases[0][name]
+
+    def __getitem__(self, name):
+        if name == 'users':
+            return self.users
+        return self.router.databases[0][name]
+
+    def backfill_email_index(self):
+        """
+        Reserve the emails of users stored before the global email index
+        existed; returns the emails held by more than one user
+        """
+        emails = self.router.databases[0][EMAIL_INDEX_COLLECTION]
+        duplicates = []
+        for database in self.router.databases:
+            for user in database.users.find({'email': {'$ne': None}}, {'email': 1}):
+                reservation = {'_id': user['email'], 'user_id': user['_id'], 'created_at': datetime.utcnow()}
+                try:
+                    emails.insert_one(reservation)
+                except DuplicateKeyError:
+                    held = emails.find_one({'_id': user['email']})
+                    if held['user_id'] != user['_id']:
+                        duplicates.append(user['email'])
+        return duplicates
+
+
+def connect_partitions(uris, db_name, refresh_interval=5.0, **client_kwargs):
+    """
+    Build a PartitionedDatabase from a comma separated list of Mongo URIs.
+    Each URI may name its own database, otherwise db_name is used. The
+    first URI also holds the shared slot map and email index.
+    """
+    databases = []
+    for uri in (u.strip() for u in uris.split(',')):
+        if not uri:
+            continue
+        partition_client = MongoClient(uri, **client_kwargs)
+        database = partition_client.get_default_database(default=db_name)
+        databases.append(database)
+    return PartitionedDatabase(UserRouter(databases, refresh_interval=refresh_interval))
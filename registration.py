@@ -0,0 +1,267 @@
+import atexit
+import base64
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from cryptography.fernet import Fernet, InvalidToken
+from pymongo import UpdateOne
+from bloom import availability_filter
+from models import User, notify_user_changed
+
+logger = logging.getLogger(__name__)
+
+# Request fields kept on a job until it is processed
+JOB_FIELDS = ('username', 'email', 'password', 'first_name', 'last_name')
+
+# Job fields reported by GET /register/status/<id>
+STATUS_FIELDS = ('status', 'user_id', 'error', 'created_at', 'finished_at')
+
+DUPLICATE_ERROR = "Username or email already exists"
+
+UNREADABLE_ERROR = "Registration could not be processed, please register again"
+
+
+def job_key():
+    """
+    Fernet key for job passwords: REGISTRATION_JOB_KEY, else derived from
+    JWT_SECRET_KEY so web and standalone workers agree without extra setup
+    """
+    key = os.getenv('REGISTRATION_JOB_KEY')
+    if key:
+        return key.encode('utf-8')
+    secret = os.getenv('JWT_SECRET_KEY', 'fallback-secret-key')
+    return base64.urlsafe_b64encode(hashlib.sha256(secret.encode('utf-8')).digest())
+
+
+class RegistrationQueue:
+    """
+    Durable signup queue backed by the registration_jobs collection.
+
+    /register only inserts a job. Worker threads claim queued jobs in
+    batches under a lease (so jobs of a worker that died are picked up
+    again), check every username/email of the batch with one query, hash
+    the passwords and insert the users with one unordered insert_many.
+
+    Passwords are stored encrypted with key (see job_key) and removed from
+    the job once it has been processed. Users are stamped with their job id,
+    so a worker re-claiming a batch whose lease ran out mid-insert reports
+    the users already inserted for it as completed.
+    """
+    def __init__(self, batch_size=50, workers=1, poll_interval=0.5, lease_seconds=60, key=None):
+        self._cipher = Fernet(key or job_key())
+        self.batch_size = batch_size
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._db_getter = None
+        self._threads = []
+
+    def start(self, db_getter):
+        """
+        Start the worker threads. db_getter returns the database at run time.
+        """
+        self._db_getter = db_getter
+        if not self._threads:
+            self._stopped.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'registration-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self._threads:
+                atexit.register(self.stop)
+
+    def enqueue(self, mongo_db, data):
+        """
+        Store a validated registration request, returns the job id
+        """
+        job = {field: data.get(field) for field in JOB_FIELDS}
+        job['password'] = self._cipher.encrypt(job['password'].encode('utf-8')).decode('ascii')
+        job['status'] = 'queued'
+        job['created_at'] = datetime.utcnow()
+        job_id = mongo_db.registration_jobs.insert_one(job).inserted_id
+        self._wakeup.set()
+        return job_id
+
+    @staticmethod
+    def status(mongo_db, job_id):
+        """
+        Public state of a job, or None if it does not exist
+        """
+        try:
+            job_id = ObjectId(job_id)
+        except (InvalidId, TypeError):
+            raise ValueError("Invalid job id")
+        job = mongo_db.registration_jobs.find_one({'_id': job_id}, {field: 1 for field in STATUS_FIELDS})
+        if job is None:
+            return None
+        status = {'job_id': str(job['_id'])}
+        status.update((field, job[field]) for field in STATUS_FIELDS if job.get(field) is not None)
+        if 'user_id' in status:
+            status['user_id'] = str(status['user_id'])
+        return status
+
+    def _claim(self, jobs):
+        """
+        Lease up to batch_size queued (or abandoned) jobs to this worker
+        """
+        now = datetime.utcnow()
+        claimable = {'$or': [
+            {'status': 'queued'},
+            {'status': 'processing', 'lease_until': {'$lt': now}}
+        ]}
+        ids = [job['_id'] for job in jobs.find(claimable, {'_id': 1}, sort=[('created_at', 1)], limit=self.batch_size)]
+        if not ids:
+            return None, []
+
+        # Another worker may claim some of the same ids first; the claim token tells ours apart
+        claim = uuid.uuid4().hex
+        jobs.update_many({'$and': [{'_id': {'$in': ids}}, claimable]}, {'$set': {
+            'status': 'processing',
+            'claim': claim,
+            'lease_until': now + timedelta(seconds=self.lease_seconds)
+        }})
+        return claim, list(jobs.find({'claim': claim}))
+
+    def process_batch(self, mongo_db):
+        """
+        Claim and process one batch, returns the number of jobs finished
+        """
+        claim, jobs = self._claim(mongo_db.registration_jobs)
+        if not jobs:
+            return 0
+
+        # One query for every username and email in the batch
+        taken = set()
+        inserted = {}
+        for user in mongo_db.users.find({'$or': [
+            {'username': {'$in': [job['username'] for job in jobs]}},
+            {'email': {'$in': [job['email'] for job in jobs]}}
+        ]}, {'username': 1, 'email': 1, 'registration_job': 1}):
+            taken.update((('username', user['username']), ('email', user['email'])))
+            if user.get('registration_job') is not None:
+                inserted[user['registration_job']] = user['_id']
+
+        results = {}
+        pending = []
+        for job in jobs:
+            if job['_id'] in inserted:
+                # Inserted by an earlier claim of this job whose lease ran out
+                results[job['_id']] = {'status': 'completed', 'user_id': inserted[job['_id']]}
+                continue
+            keys = {('username', job['username']), ('email', job['email'])}
+            if keys & taken:
+                results[job['_id']] = {'status': 'failed', 'error': DUPLICATE_ERROR}
+                continue
+            try:
+                password = self._cipher.decrypt(job['password'].encode('ascii')).decode('utf-8')
+            except (InvalidToken, AttributeError):
+                logger.error(f"Registration job {job['_id']} has an unreadable password")
+                results[job['_id']] = {'status': 'failed', 'error': UNREADABLE_ERROR}
+                continue
+            # The earliest job wins names repeated within a batch
+            taken |= keys
+            document = User.new_user_document(job['username'], job['email'], password,
+                                              job.get('first_name'), job.get('last_name'))
+            document['registration_job'] = job['_id']
+            pending.append((job, document))
+
+        for job, user_id in self._insert(mongo_db.users, pending):
+            if user_id is None:
+                results[job['_id']] = {'status': 'failed', 'error': DUPLICATE_ERROR}
+            else:
+                results[job['_id']] = {'status': 'completed', 'user_id': user_id}
+                availability_filter.add(job['username'], job['email'])
+        notify_user_changed()
+
+        finished_at = datetime.utcnow()
+        mongo_db.registration_jobs.bulk_write([
+            UpdateOne({'_id': job_id, 'claim': claim}, {
+                '$set': dict(result, finished_at=finished_at),
+                '$unset': {'password': '', 'lease_until': ''}
+            })
+            for job_id, result in results.items()
+        ], ordered=False)
+        return len(results)
+
+    def _insert(self, users, pending):
+        """
+        Insert the batch's users, yielding (job, user id or None if it clashed)
+        """
+        if not pending:
+            return
+        try:
+            users.insert_many([document for _, document in pending], ordered=False)
+        except Exception as e:
+            # Some users clashed with a concurrent registration: find out which went in
+            logger.warning(f"Batch insert of {len(pending)} users failed ({e}), retrying individually")
+            ids = [document['_id'] for _, document in pending if '_id' in document]
+            inserted = {user['_id'] for user in users.find({'_id': {'$in': ids}}, {'_id': 1})}
+            for job, document in pending:
+                if document.get('_id') not in inserted:
+                    document.pop('_id', None)
+                    try:
+                        users.insert_one(document)
+                    except Exception as insert_error:
+                        # A concurrent claim of the same job may have inserted it
+                        mine = users.find_one({'username': job['username'], 'registration_job': job['_id']},
+                                              {'_id': 1})
+                        if mine is not None:
+                            yield job, mine['_id']
+                            continue
+                        logger.warning(f"Registration job {job['_id']} failed: {insert_error}")
+                        yield job, None
+                        continue
+                yield job, document['_id']
+            return
+        for job, document in pending:
+            yield job, document['_id']
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                processed = self.process_batch(self._db_getter())
+            except Exception as e:
+                # Claimed jobs are retried once their lease runs out
+                logger.error(f"Registration batch failed: {e}", exc_info=True)
+                processed = 0
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def stop(self):
+        """
+        Stop the workers after their current batch
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=self.lease_seconds)
+        self._threads = []
+
+
+registration_queue = RegistrationQueue(
+    batch_size=int(os.getenv('REGISTRATION_BATCH_SIZE', 50)),
+    workers=int(os.getenv('REGISTRATION_WORKERS', 1)),
+    poll_interval=float(os.getenv('REGISTRATION_POLL_SECONDS', 0.5)),
+    lease_seconds=float(os.getenv('REGISTRATION_LEASE_SECONDS', 60))
+)
+
+
+if __name__ == '__main__':
+    # Standalone worker process, for hashing on other machines than the web tier
+    from config import db
+    logging.basicConfig(level=logging.INFO)
+    registration_queue.start(lambda: db)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        registration_queue.stop()
@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+import pymongo
+from flask import g, request, jsonify, has_request_context
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Default time budget (seconds) for a request's database work
+DEFAULT_DEADLINE = float(os.getenv('REQUEST_DEADLINE_SECONDS', 5))
+
+# Routes that legitimately need a different budget
+ROUTE_DEADLINES = {
+    'register': 10,
+    'change_password': 10,
+    'search_users': 2,
+    'availability': 1,
+    'user_changes': 30,     # long-poll wait (at most 25s) plus the query
+}
+
+DEADLINE_HEADER = 'X-Request-Timeout'
+
+# Endpoints that never touch the database: no deadline, never short-circuited.
+# /batch is left to its sub-requests, which are checked individually.
+EXEMPT_ENDPOINTS = {'home', 'serve_swagger', 'static', 'metrics', 'batch'}
+
+# Server error codes meaning the database, not the request, is in trouble:
+# timeouts, shutdowns and primary step-downs
+UNAVAILABLE_CODES = {50, 91, 189, 262, 10107, 11600, 11602, 13435, 13436}
+
+
+class CircuitBreaker:
+    """
+    Opens when at least min_requests outcomes within window seconds have an
+    error rate of error_threshold or more. While open every request fails fast;
+    after open_seconds a single probe request is let through (half-open) and
+    its outcome closes or re-opens the breaker.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, error_threshold=0.5, min_requests=20, window=30.0, open_seconds=15.0):
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._outcomes = deque()
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a request may go to the database now
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """
+        End a half-open probe that never reached the database without
+        deciding anything, so the next request probes instead
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def record(self, success):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if success:
+                    logger.info("Database circuit breaker closed")
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._outcomes.append((now, success))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if (self.state == self.CLOSED and len(self._outcomes) >= self.min_requests
+                    and failures / len(self._outcomes) >= self.error_threshold):
+                self._open(now)
+
+    def _open(self, now):
+        logger.error("Database circuit breaker opened")
+        self.state = self.OPEN
+        self.opened_at = now
+        self._outcomes.clear()
+
+    def retry_after(self):
+        return max(1, int(self.open_seconds - (time.monotonic() - self.opened_at)))
+
+    def stats(self):
+        return {'state': self.state, 'rejected': self.rejected}
+
+
+breaker = CircuitBreaker(
+    error_threshold=float(os.getenv('BREAKER_ERROR_RATE', 0.5)),
+    min_requests=int(os.getenv('BREAKER_MIN_REQUESTS', 20)),
+    window=float(os.getenv('BREAKER_WINDOW_SECONDS', 30)),
+    open_seconds=float(os.getenv('BREAKER_OPEN_SECONDS', 15))
+)
+
+
+def record_database_outcome(success):
+    """
+    Note how a database call of the current request went; one failure makes
+    the whole request count as failed
+    """
+    if has_request_context():
+        g.db_outcome = success and g.get('db_outcome', True)
+
+
+class DatabaseOutcomes(monitoring.CommandListener):
+    """
+    Feeds the breaker from what happened at the database rather than the
+    HTTP status. Network errors and unavailability codes are failures; any
+    other reply, errors included, shows the database is answering.
+    """
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record_database_outcome(True)
+
+    def failed(self, event):
+        failure = event.failure or {}
+        record_database_outcome('errtype' not in failure and failure.get('code') not in UNAVAILABLE_CODES)
+
+
+database_outcomes = DatabaseOutcomes()
+
+
+def request_deadline(endpoint):
+    """
+    Seconds this request may spend; the client header can only shorten it
+    """
+    deadline = ROUTE_DEADLINES.get(endpoint, DEFAULT_DEADLINE)
+    requested = request.headers.get(DEADLINE_HEADER)
+    if requested:
+        requested = float(requested)
+        if requested <= 0:
+            raise ValueError
+        deadline = min(deadline, requested)
+    return deadline
+
+
+def init_app(app):
+    """
+    Run every database-bound request under a pymongo.timeout() deadline
+    (maxTimeMS plus client-side socket/selection timeouts on every command)
+    and behind the circuit breaker
+    """
+    def exempt():
+        endpoint = request.endpoint
+        return endpoint is None or endpoint in EXEMPT_ENDPOINTS or endpoint.startswith('swagger_ui')
+
+    @app.before_request
+    def start_deadline():
+        if exempt():
+            return None
+        try:
+            deadline = request_deadline(request.endpoint)
+        except ValueError:
+            return jsonify({"error": f"{DEADLINE_HEADER} must be a positive number of seconds"}), 400
+
+        if not breaker.allow():
+            response = jsonify({"error": "Service temporarily unavailable"})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(breaker.retry_after())
+            return response
+
+        g.breaker_admitted = True
+        g.mongo_timeout = pymongo.timeout(deadline)
+        g.mongo_timeout.__enter__()
+        return None
+
+    @app.after_request
+    def record_outcome(response):
+        if g.pop('breaker_admitted', False):
+            outcome = g.pop('db_outcome', None)
+            if outcome is None and response.status_code >= 500:
+                # Failed without a single command completing: the driver could
+                # not select a server, which emits no command event
+                outcome = False
+            if outcome is None:
+                breaker.release()
+            else:
+                breaker.record(outcome)
+        return response
+
+    @app.teardown_request
+    def end_deadline(exc):
+        timeout = g.pop('mongo_timeout', None)
+        if timeout is not None:
+            timeout.__exit__(None, None, None)
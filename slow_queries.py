@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Commands explain() accepts; anything else is only logged
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+
+# Command fields explain() rejects or that only make sense for the original call
+SESSION_FIELDS = {'lsid', 'txnNumber', 'autocommit', 'startTransaction', 'writeConcern'}
+
+# Command fields logged as-is; everything else (filters, updates, documents)
+# is reduced to its shape, as values include password hashes and emails
+SHAPE_FIELDS = EXPLAINABLE_COMMANDS | {'sort', 'projection', 'hint', 'limit', 'skip', 'batchSize', 'ordered'}
+
+# Plan fields that echo the query's values
+PLAN_VALUE_FIELDS = {'filter', 'parsedQuery', 'indexBounds'}
+
+
+def _current_route():
+    """
+    Endpoint of the Flask request issuing the command, if any. Listeners run
+    on the thread that sends the command, so the request context is visible.
+    """
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+    except Exception:
+        pass
+    return None
+
+
+def _query_shape(command_name, command):
+    """
+    Coarse shape of a command (collection and filter keys) used to avoid
+    explaining the same slow pattern over and over
+    """
+    collection = command.get(command_name)
+    query = command.get('filter') or command.get('query') or {}
+    if command_name in ('update', 'delete') and command.get(command_name + 's'):
+        query = command[command_name + 's'][0].get('q', {})
+    return f"{command_name}:{collection}:{','.join(sorted(query)) if isinstance(query, dict) else ''}"
+
+
+def _redact(value):
+    """
+    value with every leaf replaced by '?', keeping keys and operators
+    """
+    if isinstance(value, dict):
+        return {k: _redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact(v) for v in value]
+    return '?'
+
+
+def _redact_command(command):
+    return {k: v if k in SHAPE_FIELDS else _redact(v) for k, v in command.items()}
+
+
+def _redact_plan(plan):
+    if isinstance(plan, dict):
+        return {k: _redact(v) if k in PLAN_VALUE_FIELDS else _redact_plan(v) for k, v in plan.items()}
+    if isinstance(plan, list):
+        return [_redact_plan(v) for v in plan]
+    return plan
+
+
+class SlowQueryMonitor(monitoring.CommandListener):
+    """
+    Flags Mongo commands slower than threshold_ms and, in a background
+    thread, logs their explain("executionStats") output as JSON. Explains
+    are limited to max_explains_per_minute overall and one per query shape
+    per shape_cooldown seconds, so a degraded database is not hit harder.
+    """
+    def __init__(self, threshold_ms=100, max_explains_per_minute=10, shape_cooldown=300, queue_size=100):
+        self.threshold_micros = threshold_ms * 1000
+        self.max_explains_per_minute = max_explains_per_minute
+        self.shape_cooldown = shape_cooldown
+        self.clients = []
+        self.slow_count = 0
+        self.explained_count = 0
+        self._started = {}
+        self._last_explained = {}
+        self._explain_times = []
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+    def attach(self, client):
+        """
+        Register a client explains may be run with and start the worker
+        """
+        self.clients.append(client)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='slow-query-explainer', daemon=True)
+            self._thread.start()
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            self._started[event.request_id] = (event.command, _current_route())
+
+    def _client_for(self, address):
+        """
+        The attached client connected to address (partitions use their own clients)
+        """
+        for client in self.clients:
+            try:
+                if address in client.nodes:
+                    return client
+            except Exception:
+                continue
+        return self.clients[0] if self.clients else None
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        started = self._started.pop(event.request_id, None)
+        if event.duration_micros < self.threshold_micros or event.command_name == 'explain':
+            return
+
+        self.slow_count += 1
+        command, route = started if started else (None, _current_route())
+        entry = {
+            'event': 'slow_query',
+            'command': event.command_name,
+            'database': event.database_name,
+            'duration_ms': round(event.duration_micros / 1000, 1),
+            'route': route,
+            'failed': isinstance(event, monitoring.CommandFailedEvent)
+        }
+        logger.warning(json.dumps(entry, default=str))
+
+        if command is not None and self._allow_explain(_query_shape(event.command_name, command)):
+            try:
+                self._queue.put_nowait((entry, event.connection_id, event.database_name, command))
+            except queue.Full:
+                pass
+
+    def _allow_explain(self, shape):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_explained.get(shape, -self.shape_cooldown) < self.shape_cooldown:
+                return False
+            self._explain_times = [t for t in self._explain_times if now - t < 60]
+            if len(self._explain_times) >= self.max_explains_per_minute:
+                return False
+            self._explain_times.append(now)
+            self._last_explained[shape] = now
+            return True
+
+    def explain(self, entry, address, database_name, command):
+        """
+        Run explain("executionStats") for a captured command and log it,
+        with the command's and plan's values redacted
+        """
+        explain_command = {k: v for k, v in command.items()
+                           if not k.startswith('$') and k not in SESSION_FIELDS}
+        client = self._client_for(address)
+        if client is None:
+            return None
+        try:
+            plan = client[database_name].command(
+                {'explain': explain_command, 'verbosity': 'executionStats'}
+            )
+        except Exception as e:
+            logger.error(f"Explain for slow {entry['command']} failed: {e}")
+            return None
+
+        stats = plan.get('executionStats', {})
+        winning_plan = plan.get('queryPlanner', {}).get('winningPlan', {})
+        logger.warning(json.dumps(dict(
+            entry,
+            event='slow_query_explain',
+            command_document=_redact_command(explain_command),
+            winning_plan=_redact_plan(winning_plan),
+            execution_time_ms=stats.get('executionTimeMillis'),
+            keys_examined=stats.get('totalKeysExamined'),
+            docs_examined=stats.get('totalDocsExamined'),
+            returned=stats.get('nReturned')
+        ), default=str))
+        self.explained_count += 1
+        return plan
+
+    def _run(self):
+        while True:
+            entry, address, database_name, command = self._queue.get()
+            try:
+                self.explain(entry, address, database_name, command)
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """
+        Wait until every queued explain has been logged
+        """
+        self._queue.join()
+
+
+slow_query_monitor = SlowQueryMonitor(
+    threshold_ms=float(os.getenv('SLOW_QUERY_MS', 100)),
+    max_explains_per_minute=int(os.getenv('SLOW_QUERY_EXPLAINS_PER_MINUTE', 10)),
+    shape_cooldown=float(os.getenv('SLOW_QUERY_SHAPE_COOLDOWN', 300))
+)
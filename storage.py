@@ -0,0 +1,391 @@
+import threading
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+# Unique indexes every in-memory users collection starts with (mirrors init_db.py)
+DEFAULT_UNIQUE_INDEXES = {'users': ('username', 'email')}
+
+_MISSING = object()
+
+
+def _get(doc, field):
+    """
+    Value of a (possibly dotted) field, or _MISSING
+    """
+    value = doc
+    for part in field.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _compare(value, op, operand):
+    if op == '$eq':
+        return value == operand
+    if op == '$ne':
+        return value != operand
+    if op == '$in':
+        return value in operand
+    if op == '$nin':
+        return value not in operand
+    if op == '$exists':
+        return (value is not _MISSING) == bool(operand)
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == '$gt':
+            return value > operand
+        if op == '$gte':
+            return value >= operand
+        if op == '$lt':
+            return value < operand
+        if op == '$lte':
+            return value <= operand
+    except TypeError:
+        return False
+    raise NotImplementedError(f"Operator {op} is not supported by the in-memory engine")
+
+
+def matches(doc, query):
+    """
+    Evaluate the subset of Mongo query syntax the app uses
+    """
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(doc, q) for q in condition):
+                return False
+        else:
+            value = _get(doc, key)
+            if isinstance(condition, dict) and condition and next(iter(condition)).startswith('$'):
+                for op, operand in condition.items():
+                    # A missing field equals null for equality style operators
+                    operand_value = None if value is _MISSING and op in ('$eq', '$ne', '$in', '$nin') else value
+                    if not _compare(operand_value, op, operand):
+                        return False
+            elif (None if value is _MISSING else value) != condition:
+                return False
+    return True
+
+
+def project(doc, projection):
+    """
+    Apply an inclusion or exclusion projection (dict or list of fields)
+    """
+    if not projection:
+        return dict(doc)
+    if not isinstance(projection, dict):
+        projection = {field: 1 for field in projection}
+    include_id = projection.get('_id', 1)
+    fields = {k: v for k, v in projection.items() if k != '_id'}
+    if any(fields.values()):
+        result = {k: doc[k] for k in fields if k in doc}
+    else:
+        result = {k: v for k, v in doc.items() if k not in fields}
+        result.pop('_id', None)
+    if include_id and '_id' in doc:
+        result['_id'] = doc['_id']
+    return result
+
+
+def _sort_key(value):
+    # Missing/None sort first, as in Mongo; types are grouped so they never compare
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, ObjectId):
+        return (3, value.binary)
+    return (4, value)
+
+
+class InMemoryCollection:
+    """
+    Thread-safe in-memory collection speaking the pymongo methods the app
+    uses. Documents are hashed by _id, and every index created (unique or
+    not) is a hash index used for equality, $in and $or-of-equality lookups, so
+    the common user queries never scan.
+    """
+    def __init__(self, name='users', unique_fields=()):
+        self.name = name
+        self._docs = {}
+        self._indexes = {}
+        self._unique = set()
+        self._lock = threading.RLock()
+        for field in unique_fields:
+            self.create_index(field, unique=True)
+
+    # Indexes
+
+    def create_index(self, keys, unique=False, **kwargs):
+        """
+        Single-field indexes are hashed; compound and TTL options are accepted
+        and ignored (nothing expires in memory)
+        """
+        field = keys if isinstance(keys, str) else keys[0][0]
+        with self._lock:
+            if field != '_id' and field not in self._indexes:
+                index = {}
+                for doc_id, doc in self._docs.items():
+                    value = _get(doc, field)
+                    if value is not _MISSING:
+                        bucket = index.setdefault(value, set())
+                        if unique and bucket:
+                            raise DuplicateKeyError(f"Duplicate key for unique index on {field}")
+                        bucket.add(doc_id)
+                self._indexes[field] = index
+            if unique:
+                self._unique.add(field)
+        return f"{field}_1"
+
+    def _index_add(self, doc):
+        for field, index in self._indexes.items():
+            value = _get(doc, field)
+            if value is not _MISSING:
+                index.setdefault(value, set()).add(doc['_id'])
+
+    def _index_remove(self, doc):
+        for field, index in self._indexes.items():
+            value = _get(doc, field)
+            bucket = index.get(value) if value is not _MISSING else None
+            if bucket is not None:
+                bucket.discard(doc['_id'])
+                if not bucket:
+                    del index[value]
+
+    def _check_unique(self, doc, ignore_id=None):
+        if doc['_id'] in self._docs and doc['_id'] != ignore_id:
+            raise DuplicateKeyError(f"Duplicate key for _id: {doc['_id']}")
+        for field in self._unique:
+            value = _get(doc, field)
+            if value is _MISSING:
+                continue
+            if self._indexes[field].get(value, set()) - {ignore_id}:
+                raise DuplicateKeyError(f"Duplicate key for unique index on {field}: {value}")
+
+    def _candidate_ids(self, query):
+        """
+        Ids that may match query, from the hash indexes when possible
+        """
+        if not query:
+            return list(self._docs)
+
+        def equality(condition):
+            """
+            (True, values) when condition only matches documents whose field
+            equals one of values
+            """
+            if isinstance(condition, dict):
+                if set(condition) == {'$eq'}:
+                    values = [condition['$eq']]
+                elif set(condition) == {'$in'} and isinstance(condition['$in'], (list, tuple)):
+                    values = list(condition['$in'])
+                else:
+                    return False, None
+            else:
+                values = [condition]
+            # null also matches missing fields, which indexes do not hold
+            return all(v is not None and not isinstance(v, (list, dict)) for v in values), values
+
+        def lookup(field, values):
+            if field == '_id':
+                return [v for v in values if v in self._docs]
+            ids = []
+            for value in values:
+                try:
+                    ids.extend(self._indexes[field].get(value, ()))
+                except TypeError:
+                    pass
+            return ids
+
+        for field, condition in query.items():
+            is_equality, values = equality(condition)
+            if is_equality and (field == '_id' or field in self._indexes):
+                return list(dict.fromkeys(lookup(field, values)))
+
+        branches = query.get('$or')
+        if branches and len(query) == 1:
+            ids = set()
+            for branch in branches:
+                if len(branch) != 1:
+                    return list(self._docs)
+                (field, condition), = branch.items()
+                is_equality, values = equality(condition)
+                if not (is_equality and (field == '_id' or field in self._indexes)):
+                    return list(self._docs)
+                ids.update(lookup(field, values))
+            return list(ids)
+        return list(self._docs)
+
+    def _matching(self, query):
+        query = query or {}
+        return [doc for doc in (self._docs.get(i) for i in self._candidate_ids(query))
+                if doc is not None and matches(doc, query)]
+
+    # Reads
+
+    def find(self, query=None, projection=None, sort=None, limit=0, skip=0, **kwargs):
+        with self._lock:
+            docs = self._matching(query)
+            for field, direction in reversed(sort or []):
+                docs.sort(key=lambda doc: _sort_key(_get(doc, field)), reverse=direction < 0)
+            if skip:
+                docs = docs[skip:]
+            if limit:
+                docs = docs[:limit]
+            return [project(doc, projection) for doc in docs]
+
+    def find_one(self, query=None, projection=None, **kwargs):
+        found = self.find(query, projection, limit=1, **kwargs)
+        return found[0] if found else None
+
+    def count_documents(self, query, **kwargs):
+        with self._lock:
+            return len(self._matching(query))
+
+    # Writes
+
+    def insert_one(self, document, **kwargs):
+        document.setdefault('_id', ObjectId())
+        doc = dict(document)
+        with self._lock:
+            self._check_unique(doc)
+            self._docs[doc['_id']] = doc
+            self._index_add(doc)
+        return InsertOneResult(doc['_id'], True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        """
+        As in pymongo, duplicates raise BulkWriteError listing every failed
+        index; ordered inserts stop at the first one
+        """
+        inserted_ids = []
+        errors = []
+        for index, document in enumerate(documents):
+            try:
+                inserted_ids.append(self.insert_one(document).inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(e), 'op': document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'writeConcernErrors': [], 'nInserted': len(inserted_ids),
+                                  'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []})
+        return InsertManyResult(inserted_ids, True)
+
+    def _apply_update(self, doc, update):
+        updated = dict(doc)
+        for op, changes in update.items():
+            for field, value in changes.items():
+                current = updated.get(field)
+                if op == '$set':
+                    updated[field] = value
+                elif op == '$unset':
+                    updated.pop(field, None)
+                elif op == '$inc':
+                    updated[field] = (current or 0) + value
+                elif op == '$max':
+                    updated[field] = value if current is None or value > current else current
+                elif op == '$min':
+                    updated[field] = value if current is None or value < current else current
+                else:
+                    raise NotImplementedError(f"Update operator {op} is not supported by the in-memory engine")
+        return updated
+
+    def _update(self, query, update, many, upsert=False):
+        with self._lock:
+            targets = self._matching(query)
+            if not many:
+                targets = targets[:1]
+            modified = 0
+            for doc in targets:
+                updated = self._apply_update(doc, update)
+                if updated == doc:
+                    continue
+                self._check_unique(updated, ignore_id=doc['_id'])
+                self._index_remove(doc)
+                self._docs[doc['_id']] = updated
+                self._index_add(updated)
+                modified += 1
+            raw = {'n': len(targets), 'nModified': modified}
+            if not targets and upsert:
+                seed = {k: v for k, v in (query or {}).items() if not k.startswith('$') and not isinstance(v, dict)}
+                inserted = self._apply_update(seed, {k: v for k, v in update.items() if k != '$setOnInsert'})
+                inserted.update(update.get('$setOnInsert', {}))
+                raw = {'n': 1, 'nModified': 0, 'upserted': self.insert_one(inserted).inserted_id}
+            return UpdateResult(raw, True)
+
+    def update_one(self, query, update, upsert=False, **kwargs):
+        return self._update(query, update, many=False, upsert=upsert)
+
+    def update_many(self, query, update, upsert=False, **kwargs):
+        return self._update(query, update, many=True, upsert=upsert)
+
+    def _delete(self, query, many):
+        with self._lock:
+            targets = self._matching(query)
+            if not many:
+                targets = targets[:1]
+            for doc in targets:
+                self._index_remove(doc)
+                del self._docs[doc['_id']]
+            return DeleteResult({'n': len(targets)}, True)
+
+    def delete_one(self, query, **kwargs):
+        return self._delete(query, many=False)
+
+    def delete_many(self, query, **kwargs):
+        return self._delete(query, many=True)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        """
+        Supports UpdateOne/UpdateMany/DeleteOne/DeleteMany (read from pymongo's
+        private _filter/_doc attributes, as no public accessor exists)
+        """
+        matched = modified = deleted = 0
+        for operation in requests:
+            name = type(operation).__name__
+            if name in ('UpdateOne', 'UpdateMany'):
+                result = self._update(operation._filter, operation._doc, many=name == 'UpdateMany',
+                                      upsert=bool(operation._upsert))
+                matched += result.matched_count
+                modified += result.modified_count
+            elif name in ('DeleteOne', 'DeleteMany'):
+                deleted += self._delete(operation._filter, many=name == 'DeleteMany').deleted_count
+            else:
+                raise NotImplementedError(f"{name} is not supported by the in-memory engine")
+        return BulkWriteResult({'nMatched': matched, 'nModified': modified, 'nRemoved': deleted,
+                                'nInserted': 0, 'nUpserted': 0, 'upserted': []}, True)
+
+
+class InMemoryDatabase:
+    """
+    Stands in for config.db: collections are created on first access
+    """
+    def __init__(self, name='memory'):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = InMemoryCollection(name, DEFAULT_UNIQUE_INDEXES.get(name, ()))
+                self._collections[name] = collection
+            return collection
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def command(self, command, *args, **kwargs):
+        # Enough for the startup ping
+        return {'ok': 1.0}
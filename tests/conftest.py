@@ -7,67 +7,91 @@ import uuid
 # Add the project root directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app import app
-import mongomock
+# Every test runs on the in-memory engine: never ping a real Mongo at import
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+from activity import login_activity
+from app import app, search_cache
+from bloom import availability_filter
+from claims import profile_changes
 from config import client, db
+from dbstats import CountingCollection
+from idempotency import response_cache
+from models import profile_cache
+from storage import InMemoryDatabase
+
+# Collections the app reads through config.db
+APP_COLLECTIONS = ('users', 'refresh_tokens', 'idempotency_keys', 'registration_jobs', 'profile_changes')
 
 @pytest.fixture(scope='function')
-def test_client():
-    """Create a test client using Flask's test_config"""
+def mongo_db():
+    """Install a fresh in-memory database as the app's storage"""
+    # Write out logins buffered by an earlier test while its database is still installed
+    login_activity.flush()
+    memory = InMemoryDatabase()
+    for name in APP_COLLECTIONS:
+        setattr(db, name, memory[name])
+
+    # Nothing cached from an earlier test's data
+    profile_cache.clear()
+    search_cache.clear()
+    response_cache.clear()
+    profile_changes.clear()
+    availability_filter.warm(db.users)
+    return db
+
+@pytest.fixture(scope='function')
+def test_client(mongo_db):
+    """Create a test client backed by the in-memory storage engine"""
     app.config['TESTING'] = True
-    
-    # Mock MongoDB connection
-    mock_client = mongomock.MongoClient()
-    mock_db = mock_client.db
-    
-    # Replace the actual MongoDB client with mock client in the app
-    client.admin = mock_client.admin
-    db.users = mock_db.users
-    
-    # Clear existing users before each test
-    db.users.delete_many({})
-    
+
     with app.test_client() as test_flask_client:
         yield test_flask_client
 
 @pytest.fixture(scope='function')
-def jwt_token(test_client):
+def db_stats(mongo_db, monkeypatch):
+    """Report X-DB-Calls; the in-memory engine emits no command events, so count at the collection"""
+    monkeypatch.setitem(app.config, 'DB_STATS_HEADERS', True)
+    for name in APP_COLLECTIONS:
+        setattr(mongo_db, name, CountingCollection(getattr(mongo_db, name)))
+    return mongo_db
+
+@pytest.fixture(scope='function')
+def service_headers(monkeypatch):
+    """Headers of an internal service allowed to read any user's profile"""
+    monkeypatch.setitem(app.config, 'SERVICE_API_KEY', 'service-secret')
+    return {'X-Service-Token': 'service-secret'}
+
+@pytest.fixture(scope='function')
+def make_user(test_client):
+    """
+    Register and log in a user. make_user(username=None) returns the login
+    response body plus user_id, username and Authorization headers.
+    """
+    def make(username=None, password='testpassword123'):
+        username = username or f"testuser_{uuid.uuid4().hex[:8]}"
+        register_response = test_client.post('/register',
+            data=json.dumps({'username': username, 'email': f"{username.lower()}@example.com", 'password': password}),
+            content_type='application/json'
+        )
+        assert register_response.status_code == 201
+
+        login_response = test_client.post('/login',
+            data=json.dumps({'username': username, 'password': password}),
+            content_type='application/json'
+        )
+        assert login_response.status_code == 200
+
+        user = json.loads(login_response.data)
+        user.update(user_id=json.loads(register_response.data)['user_id'], username=username,
+                    headers={'Authorization': f"Bearer {user['access_token']}"})
+        return user
+    return make
+
+@pytest.fixture(scope='function')
+def jwt_token(make_user):
     """Generate a JWT token for authenticated tests"""
-    # Generate unique username and email
-    unique_username = f"testuser_{uuid.uuid4().hex[:8]}"
-    unique_email = f"{unique_username}@example.com"
-    
-    # Create a test user
-    test_user = {
-        'username': unique_username,
-        'email': unique_email,
-        'password': 'testpassword123'
-    }
-    
-    # Register the user
-    register_response = test_client.post('/register', 
-        data=json.dumps(test_user),
-        content_type='application/json'
-    )
-    
-    # Verify registration
-    assert register_response.status_code == 201
-    
-    # Login to get the token
-    login_response = test_client.post('/login', 
-        data=json.dumps({
-            'username': unique_username,
-            'password': 'testpassword123'
-        }),
-        content_type='application/json'
-    )
-    
-    # Verify login
-    assert login_response.status_code == 200
-    
-    # Return the token
-    login_data = json.loads(login_response.data)
-    return login_data.get('access_token')
+    return make_user()['access_token']
 
 @pytest.fixture
 def cleanup_test_data():
@@ -77,4 +101,4 @@ def cleanup_test_data():
     db.users.delete_many({
         'username': 'testuser',
         'email': 'test@example.com'
-    }) 
\ No newline at end of file
+    })
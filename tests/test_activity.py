@@ -0,0 +1,92 @@
+import json
+import pytest
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta
+from app import app
+from config import client, db
+from activity import LoginActivityBuffer, login_activity
+from storage import InMemoryDatabase
+
+def test_buffer_coalesces_logins():
+    """Test many logins become one update per user"""
+    users = InMemoryDatabase().users
+    users.insert_many([{'_id': 'a'}, {'_id': 'b'}])
+    buffer = LoginActivityBuffer(flush_interval=3600)
+    buffer.start(lambda: users)
+    
+    now = datetime.utcnow()
+    buffer.record('a', now - timedelta(minutes=5))
+    buffer.record('a', now)
+    buffer.record('a', now - timedelta(minutes=1))
+    buffer.record('b', now)
+    
+    # Nothing is written until the flush
+    assert users.find_one({'_id': 'a'}).get('login_count') is None
+    assert buffer.flush() == 2
+    buffer.stop()
+    
+    user_a = users.find_one({'_id': 'a'})
+    assert user_a['login_count'] == 3
+    assert abs(user_a['last_login_at'] - now) < timedelta(seconds=1)
+    assert users.find_one({'_id': 'b'})['login_count'] == 1
+
+def test_buffer_is_bounded():
+    """Test new users are dropped once max_pending is reached"""
+    buffer = LoginActivityBuffer(flush_interval=3600, batch_size=100, max_pending=2)
+    users = InMemoryDatabase().users
+    buffer._collection_getter = lambda: users
+    
+    for user_id in ('a', 'b', 'c'):
+        buffer.record(user_id)
+    buffer.record('a')
+    
+    assert buffer.dropped == 1
+    assert buffer.flush() == 2
+
+def test_partial_failure_requeues_only_failed_users():
+    """Test users whose update was applied are not counted twice after a partial failure"""
+    users = InMemoryDatabase().users
+    users.insert_many([{'_id': 'a'}, {'_id': 'b'}, {'_id': 'c'}])
+    apply = users.bulk_write
+    def partially_failing_bulk_write(operations, ordered=True):
+        apply([operation for index, operation in enumerate(operations) if index != 1])
+        raise BulkWriteError({'writeErrors': [{'index': 1, 'code': 50, 'errmsg': 'timeout'}]})
+    users.bulk_write = partially_failing_bulk_write
+    buffer = LoginActivityBuffer(flush_interval=3600)
+    buffer._collection_getter = lambda: users
+
+    for user_id in ('a', 'b', 'c'):
+        buffer.record(user_id)
+    assert buffer.flush() == 2
+
+    users.bulk_write = apply
+    assert buffer.flush() == 1
+    assert [user['login_count'] for user in users.find(sort=[('_id', 1)])] == [1, 1, 1]
+
+def test_login_records_activity(test_client):
+    """Test logins show up on the profile after a flush"""
+    user_data = {
+        'username': 'activeuser',
+        'email': 'activeuser@example.com',
+        'password': 'testpassword123'
+    }
+    test_client.post('/register', 
+                     data=json.dumps(user_data),
+                     content_type='application/json')
+    
+    for _ in range(2):
+        login_response = test_client.post('/login', 
+                                          data=json.dumps({
+                                              'username': 'activeuser',
+                                              'password': 'testpassword123'
+                                          }),
+                                          content_type='application/json')
+        assert login_response.status_code == 200
+    
+    login_activity.flush()
+    token = json.loads(login_response.data)['access_token']
+    response = test_client.get('/profile?fields=login_count,last_login_at', 
+                               headers={'Authorization': f'Bearer {token}'})
+    data = json.loads(response.data)
+    assert data['login_count'] == 2
+    assert data['last_login_at'] is not None
@@ -3,27 +3,6 @@ import pytest
 import uuid
 from app import app
 from config import client, db
-import mongomock
-
-@pytest.fixture
-def test_client():
-    """Create a test client using Flask's test_config"""
-    app.config['TESTING'] = True
-    
-    # Mock MongoDB connection
-    mock_client = mongomock.MongoClient()
-    mock_db = mock_client.db
-    
-    # Replace the actual MongoDB client with mock client in the app
-    from config import client as mongo_client, db as mongo_db
-    mongo_client.admin = mock_client.admin
-    mongo_db.users = mock_db.users
-    
-    # Clear existing users before each test
-    mongo_db.users.delete_many({})
-    
-    with app.test_client() as test_flask_client:
-        yield test_flask_client
 
 def test_register_success(test_client):
     """Test successful user registration"""
@@ -214,4 +193,45 @@ def test_login_missing_credentials(test_client):
                                        data=json.dumps(login_data2),
                                        content_type='application/json')
     
-    assert login_response2.status_code == 400 
\ No newline at end of file
+    assert login_response2.status_code == 400 
+def test_refresh_token_rotation(test_client, make_user):
+    """Test refreshing issues new tokens and retires the old refresh token"""
+    tokens = make_user()
+    assert 'refresh_token' in tokens
+    
+    refresh_response = test_client.post('/token/refresh', 
+                                        headers={'Authorization': f"Bearer {tokens['refresh_token']}"})
+    assert refresh_response.status_code == 200
+    refreshed = json.loads(refresh_response.data)
+    assert 'access_token' in refreshed
+    assert refreshed['refresh_token'] != tokens['refresh_token']
+    
+    # The new access token works
+    profile_response = test_client.get('/profile', 
+                                       headers={'Authorization': f"Bearer {refreshed['access_token']}"})
+    assert profile_response.status_code == 200
+    
+    # Replaying the old refresh token fails and revokes the whole family
+    replay_response = test_client.post('/token/refresh', 
+                                       headers={'Authorization': f"Bearer {tokens['refresh_token']}"})
+    assert replay_response.status_code == 401
+    
+    revoked_response = test_client.post('/token/refresh', 
+                                        headers={'Authorization': f"Bearer {refreshed['refresh_token']}"})
+    assert revoked_response.status_code == 401
+
+def test_refresh_requires_refresh_token(test_client, make_user):
+    """Test access tokens cannot be used to refresh"""
+    tokens = make_user()
+    
+    response = test_client.post('/token/refresh', 
+                                headers={'Authorization': f"Bearer {tokens['access_token']}"})
+    assert response.status_code == 422
+
+def test_revoke_refresh_token(test_client, make_user):
+    """Test a revoked refresh token can no longer be used"""
+    tokens = make_user()
+    headers = {'Authorization': f"Bearer {tokens['refresh_token']}"}
+    
+    assert test_client.post('/token/revoke', headers=headers).status_code == 200
+    assert test_client.post('/token/refresh', headers=headers).status_code == 401
@@ -0,0 +1,80 @@
+import json
+import pytest
+from config import db
+from bloom import AvailabilityFilter, BloomFilter
+from storage import InMemoryDatabase
+
+def test_bloom_filter_has_no_false_negatives():
+    """Test every added value is reported as present"""
+    bloom = BloomFilter(1000)
+    values = [f'user{i}' for i in range(1000)]
+    for value in values:
+        bloom.add(value)
+    
+    assert all(value in bloom for value in values)
+    false_positives = sum(f'other{i}' in bloom for i in range(1000))
+    assert false_positives < 50
+
+def test_availability_after_register(test_client):
+    """Test availability reflects registered users"""
+    user_data = {
+        'username': 'takenuser',
+        'email': 'taken@example.com',
+        'password': 'testpassword123'
+    }
+    register_response = test_client.post('/register', 
+                                         data=json.dumps(user_data),
+                                         content_type='application/json')
+    assert register_response.status_code == 201
+    
+    response = test_client.get('/availability?username=takenuser&email=free@example.com')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['username']['available'] is False
+    assert data['email']['available'] is True
+
+def test_availability_skips_database_when_free(test_client, monkeypatch):
+    """Test a name the filter has never seen is answered without a query"""
+    def fail_find_one(*args, **kwargs):
+        raise AssertionError("find_one should not be called")
+    monkeypatch.setattr(db.users, 'find_one', fail_find_one)
+    
+    response = test_client.get('/availability?username=neverseen')
+    assert response.status_code == 200
+    assert json.loads(response.data)['username']['available'] is True
+
+def test_warm_swaps_filters(test_client):
+    """Test names stay taken while a rebuild is loading and adds made meanwhile are kept"""
+    bloom = AvailabilityFilter(capacity=1000)
+    users = InMemoryDatabase().users
+    users.insert_one({'username': 'olduser', 'email': 'old@example.com'})
+    bloom.warm(users)
+
+    seen_during_load = []
+    class SlowUsers:
+        def find(self, *args, **kwargs):
+            for user in users.find(*args, **kwargs):
+                seen_during_load.append(bloom.username_maybe_taken('olduser'))
+                bloom.add('racer', 'racer@example.com')
+                yield user
+
+    assert bloom.warm(SlowUsers()) == 1
+    assert seen_during_load == [True]
+    assert bloom.username_maybe_taken('racer')
+
+def test_refresh_adds_users_from_other_processes(test_client):
+    """Test users inserted behind the filter's back are picked up by refresh"""
+    bloom = AvailabilityFilter(capacity=1000)
+    users = InMemoryDatabase().users
+    bloom.warm(users)
+
+    users.insert_one({'username': 'elsewhere', 'email': 'elsewhere@example.com'})
+    assert not bloom.username_maybe_taken('elsewhere')
+    assert bloom.refresh(users) == 1
+    assert bloom.username_maybe_taken('elsewhere')
+    assert bloom.email_maybe_taken('elsewhere@example.com')
+
+def test_availability_missing_params(test_client):
+    """Test availability without username or email"""
+    response = test_client.get('/availability')
+    assert response.status_code == 400
@@ -0,0 +1,97 @@
+import json
+import pytest
+
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_batch_authenticated_requests(test_client, make_user, concurrent):
+    """Test sub-requests share the caller's token and keep their order"""
+    user = make_user()
+    username, token = user['username'], user['access_token']
+    
+    batch_data = {
+        'concurrent': concurrent,
+        'requests': [
+            {'method': 'GET', 'path': '/profile'},
+            {'method': 'GET', 'path': '/'},
+            {'method': 'POST', 'path': '/change-password', 'body': {
+                'current_password': 'wrongpassword',
+                'new_password': 'newpassword456'
+            }}
+        ]
+    }
+    response = test_client.post('/batch', 
+        data=json.dumps(batch_data),
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    
+    assert response.status_code == 200
+    responses = json.loads(response.data)['responses']
+    assert [r['status'] for r in responses] == [200, 200, 400]
+    assert responses[0]['body']['username'] == username
+    assert responses[1]['body']['message'] == "Welcome to the Home Page"
+
+def test_batch_without_token(test_client):
+    """Test protected sub-requests fail individually without a token"""
+    batch_data = {
+        'requests': [
+            {'method': 'GET', 'path': '/profile'},
+            {'method': 'GET', 'path': '/'},
+            {'method': 'POST', 'path': '/batch', 'body': {'requests': []}}
+        ]
+    }
+    response = test_client.post('/batch', 
+        data=json.dumps(batch_data),
+        content_type='application/json'
+    )
+    
+    assert response.status_code == 200
+    responses = json.loads(response.data)['responses']
+    assert [r['status'] for r in responses] == [401, 200, 400]
+
+def test_batch_invalid_body(test_client):
+    """Test an empty batch is rejected"""
+    response = test_client.post('/batch', 
+        data=json.dumps({'requests': []}),
+        content_type='application/json'
+    )
+    assert response.status_code == 400
+    assert json.loads(response.data)['field'] == 'requests'
+
+def test_batch_malformed_entries(test_client):
+    """Test a malformed entry fails on its own instead of failing the batch"""
+    batch_data = {
+        'requests': [
+            {'method': 5, 'path': '/'},
+            {'method': 'TRACE', 'path': '/'},
+            {'method': 'GET', 'path': '/', 'headers': ['x']},
+            {'method': 'GET', 'path': '/', 'headers': {'X-Count': 3}},
+            {'method': 'get', 'path': '/', 'headers': {'X-Trace': 'abc'}}
+        ]
+    }
+    response = test_client.post('/batch',
+        data=json.dumps(batch_data),
+        content_type='application/json'
+    )
+
+    assert response.status_code == 200
+    responses = json.loads(response.data)['responses']
+    assert [r['status'] for r in responses] == [400, 400, 400, 400, 200]
+
+def test_batch_cannot_nest_through_encoded_path(test_client):
+    """Test a batch entry routed to /batch is rejected however the path is spelled"""
+    nested = {'requests': [{'method': 'GET', 'path': '/'}]}
+    batch_data = {
+        'requests': [
+            {'method': 'POST', 'path': '/%62atch', 'body': nested},
+            {'method': 'POST', 'path': '/batch?x=1', 'body': nested}
+        ]
+    }
+    response = test_client.post('/batch',
+        data=json.dumps(batch_data),
+        content_type='application/json'
+    )
+
+    assert response.status_code == 200
+    responses = json.loads(response.data)['responses']
+    assert [r['status'] for r in responses] == [400, 400]
+    assert all('responses' not in (r['body'] or {}) for r in responses)
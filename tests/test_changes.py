@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+import pytest
+import app as app_module
+from app import app
+from models import User
+
+pytestmark = pytest.mark.usefixtures('service_headers')
+
+SERVICE_HEADERS = {'X-Service-Token': 'service-secret'}
+
+@pytest.fixture(autouse=True)
+def no_settle_delay(monkeypatch):
+    """Serve changes as soon as they are written"""
+    monkeypatch.setattr(app_module, 'CHANGES_SETTLE_SECONDS', 0)
+
+def get_changes(client, query=''):
+    response = client.get(f'/users/changes{query}', headers=SERVICE_HEADERS)
+    assert response.status_code == 200
+    return json.loads(response.data)
+
+def test_changes_pages_and_resumes(test_client, make_user):
+    """Test the feed pages in (updated_at, _id) order and resumes after edits"""
+    users = [make_user(name) for name in ('alpha', 'bravo', 'charlie')]
+    ids, headers = [user['user_id'] for user in users], users[0]['headers']
+
+    page = get_changes(test_client, '?limit=2')
+    assert [user['_id'] for user in page['users']] == ids[:2]
+    assert page['has_more'] is True
+    assert 'password_hash' not in page['users'][0]
+
+    page = get_changes(test_client, f"?limit=2&since={page['next']}")
+    assert [user['_id'] for user in page['users']] == ids[2:]
+    assert page['has_more'] is False
+    cursor = page['next']
+
+    # Nothing new: the cursor comes back unchanged
+    page = get_changes(test_client, f'?since={cursor}')
+    assert page['users'] == []
+    assert page['next'] == cursor
+
+    time.sleep(0.01)
+    response = test_client.put('/profile', data=json.dumps({'first_name': 'Alpha'}),
+                               content_type='application/json', headers=headers)
+    assert response.status_code == 200
+
+    page = get_changes(test_client, f'?since={cursor}')
+    assert [user['_id'] for user in page['users']] == ids[:1]
+    assert page['users'][0]['first_name'] == 'Alpha'
+
+def test_changes_long_poll_wakes_on_write(test_client, mongo_db, make_user):
+    """Test a waiting reader returns as soon as a user changes"""
+    user = make_user('delta')
+    cursor = get_changes(test_client)['next']
+
+    def edit():
+        time.sleep(0.2)
+        User.update_user(mongo_db, user['user_id'], {'last_name': 'Later'})
+    threading.Thread(target=edit).start()
+
+    started = time.monotonic()
+    users, next_cursor, _ = User.changes(mongo_db, cursor, wait=5)
+    assert time.monotonic() - started < 2
+    assert [user.last_name for user in users] == ['Later']
+    assert next_cursor != cursor
+
+def test_changes_invalid_parameters(test_client):
+    """Test malformed cursors and parameters are rejected"""
+    for query, field in (('?since=garbage', 'since'), ('?limit=many', 'limit'), ('?wait=soon', 'wait'),
+                         ('?wait=nan', 'wait'), ('?wait=inf', 'wait')):
+        response = test_client.get(f'/users/changes{query}', headers=SERVICE_HEADERS)
+        assert response.status_code == 400
+        assert json.loads(response.data)['field'] == field
+
+def test_changes_require_service_token(test_client, make_user, monkeypatch):
+    """Test user tokens and wrong service tokens cannot read the feed"""
+    user = make_user('foxtrot')
+    for headers in (user['headers'], {}, {'X-Service-Token': 'wrong'}):
+        response = test_client.get('/users/changes', headers=headers)
+        assert response.status_code == 401
+
+    # Without a configured key the feed is off
+    monkeypatch.setitem(app.config, 'SERVICE_API_KEY', None)
+    response = test_client.get('/users/changes', headers=SERVICE_HEADERS)
+    assert response.status_code == 403
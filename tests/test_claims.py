@@ -0,0 +1,114 @@
+import json
+import time
+import pytest
+from flask_jwt_extended import create_access_token
+from app import app
+from claims import ProfileChanges, profile_changes
+
+# Profile reads report their DB calls
+pytestmark = pytest.mark.usefixtures('db_stats')
+
+@pytest.fixture(autouse=True)
+def profile_claims(monkeypatch):
+    """Issue profile-carrying access tokens"""
+    monkeypatch.setitem(app.config, 'PROFILE_CLAIMS', True)
+
+def get_profile(test_client, token, query=''):
+    response = test_client.get(f'/profile{query}', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    return json.loads(response.data), int(response.headers['X-DB-Calls'])
+
+def test_profile_served_from_token(test_client, make_user):
+    """Test GET /profile answers from the token with no DB round trip"""
+    tokens = make_user('claimsuser')
+
+    profile, calls = get_profile(test_client, tokens['access_token'])
+    assert calls == 0
+    assert profile['username'] == 'claimsuser'
+    assert profile['email'] == 'claimsuser@example.com'
+
+    # Same encoding as a database read of the same fields
+    with app.app_context():
+        plain_token = create_access_token(identity=profile['_id'])
+    query = '?fields=_id,username,email,first_name,last_name,created_at,updated_at'
+    from_db, calls = get_profile(test_client, plain_token, query)
+    assert calls == 1
+    assert from_db == profile
+
+    # Fields not carried by the token still come from Mongo
+    profile, calls = get_profile(test_client, tokens['access_token'], '?fields=username,login_count')
+    assert calls == 1
+    assert 'login_count' in profile
+
+def test_profile_edit_invalidates_token_profile(test_client, make_user):
+    """Test a profile edit forces DB reads until a newer token is issued"""
+    tokens = make_user('claimsuser')
+    old_token = tokens['access_token']
+
+    response = test_client.put('/profile', data=json.dumps({'first_name': 'Changed'}),
+                               content_type='application/json',
+                               headers={'Authorization': f'Bearer {old_token}'})
+    assert response.status_code == 200
+
+    profile, calls = get_profile(test_client, old_token)
+    assert calls == 1
+    assert profile['first_name'] == 'Changed'
+
+    # Token issue times have whole-second precision
+    time.sleep(1.1)
+    response = test_client.post('/token/refresh',
+                                headers={'Authorization': f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 200
+
+    profile, calls = get_profile(test_client, json.loads(response.data)['access_token'])
+    assert calls == 0
+    assert profile['first_name'] == 'Changed'
+
+def test_token_profile_ignored_once_claims_are_off(test_client, make_user, monkeypatch):
+    """Test tokens issued with PROFILE_CLAIMS on are not trusted after it is turned off"""
+    tokens = make_user('claimsuser')
+    monkeypatch.setitem(app.config, 'PROFILE_CLAIMS', False)
+
+    response = test_client.put('/profile', data=json.dumps({'first_name': 'Changed'}),
+                               content_type='application/json',
+                               headers={'Authorization': f"Bearer {tokens['access_token']}"})
+    assert response.status_code == 200
+
+    profile, calls = get_profile(test_client, tokens['access_token'], '?fields=first_name')
+    assert calls == 1
+    assert profile['first_name'] == 'Changed'
+
+def test_profile_change_reaches_other_workers(test_client, mongo_db, make_user):
+    """Test a change recorded by one worker is picked up by another's sync"""
+    tokens = make_user('claimsuser')
+    user_id = get_profile(test_client, tokens['access_token'])[0]['_id']
+    response = test_client.put('/profile', data=json.dumps({'first_name': 'Elsewhere'}),
+                               content_type='application/json',
+                               headers={'Authorization': f"Bearer {tokens['access_token']}"})
+    assert response.status_code == 200
+
+    other_worker = ProfileChanges()
+    assert other_worker.changed_at(user_id) is None
+    assert other_worker.sync(mongo_db.profile_changes) == 1
+    assert other_worker.changed_at(user_id) == profile_changes.changed_at(user_id)
+
+    # Markers last as long as the access tokens they invalidate
+    change = mongo_db.profile_changes.find_one({'_id': user_id})
+    assert change['lifetime'] == app.config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds()
+
+def test_full_marker_table_falls_back_to_database():
+    """Test markers are never evicted: past maxsize older tokens are all treated as stale"""
+    changes = ProfileChanges(maxsize=2)
+    now = time.time()
+    changes._record('a', now - 2, 900)
+    changes._record('b', now - 1, 900)
+    changes._record('c', now, 900)
+
+    # c could not be tracked, so every token issued by then is stale, for every user
+    for user_id in ('a', 'b', 'c', 'unrelated'):
+        assert changes.changed_at(user_id) == now
+
+    # Once tokens from before the overflow have expired, markers apply again
+    changes._overflow_until = now - 1
+    assert changes.changed_at('a') == now - 2
+    assert changes.changed_at('unrelated') is None
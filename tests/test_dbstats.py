@@ -0,0 +1,80 @@
+import json
+import pytest
+from dbstats import ROUTE_BUDGETS
+from idempotency import IDEMPOTENCY_DB_CALLS
+
+# DB calls are counted per request
+pytestmark = pytest.mark.usefixtures('db_stats')
+
+def assert_within_budget(response, endpoint):
+    """Fail if a request used more DB round trips than its route budget"""
+    calls = int(response.headers['X-DB-Calls'])
+    assert response.headers['X-DB-Budget'] == str(ROUTE_BUDGETS[endpoint])
+    assert calls <= ROUTE_BUDGETS[endpoint], f"{endpoint} made {calls} DB calls"
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    return calls
+
+def test_routes_stay_within_db_budgets(test_client):
+    """Test the main routes do not exceed their DB round trip budgets"""
+    user_data = {
+        'username': 'budgetuser',
+        'email': 'budgetuser@example.com',
+        'password': 'testpassword123'
+    }
+    response = test_client.post('/register', data=json.dumps(user_data), content_type='application/json')
+    assert response.status_code == 201
+    assert_within_budget(response, 'register')
+    
+    response = test_client.post('/login', 
+                                data=json.dumps({'username': 'budgetuser', 'password': 'testpassword123'}),
+                                content_type='application/json')
+    assert response.status_code == 200
+    assert_within_budget(response, 'login')
+    headers = {'Authorization': f"Bearer {json.loads(response.data)['access_token']}"}
+    
+    response = test_client.get('/profile', headers=headers)
+    assert response.status_code == 200
+    assert assert_within_budget(response, 'get_profile') == 1
+    
+    response = test_client.put('/profile', data=json.dumps({'first_name': 'Budget'}),
+                               content_type='application/json', headers=headers)
+    assert response.status_code == 200
+    assert_within_budget(response, 'edit_profile')
+    
+    response = test_client.post('/change-password', 
+                                data=json.dumps({'current_password': 'testpassword123',
+                                                 'new_password': 'newpassword456'}),
+                                content_type='application/json', headers=headers)
+    assert response.status_code == 200
+    assert_within_budget(response, 'change_password')
+
+def test_idempotency_key_calls_are_budgeted(test_client, make_user):
+    """Test a keyed request is held to its route budget plus the idempotency calls"""
+    user_data = {
+        'username': 'keyeduser',
+        'email': 'keyeduser@example.com',
+        'password': 'testpassword123'
+    }
+    response = test_client.post('/register', data=json.dumps(user_data), content_type='application/json',
+                                headers={'Idempotency-Key': 'budget-1'})
+    assert response.status_code == 201
+    assert response.headers['X-DB-Budget'] == str(ROUTE_BUDGETS['register'] + IDEMPOTENCY_DB_CALLS)
+    assert int(response.headers['X-DB-Calls']) <= ROUTE_BUDGETS['register'] + IDEMPOTENCY_DB_CALLS
+
+    headers = make_user('keyeduser2')['headers']
+    headers['Idempotency-Key'] = 'budget-2'
+    response = test_client.post('/change-password',
+                                data=json.dumps({'current_password': 'testpassword123',
+                                                 'new_password': 'newpassword456'}),
+                                content_type='application/json', headers=headers)
+    assert response.status_code == 200
+    budget = ROUTE_BUDGETS['change_password'] + IDEMPOTENCY_DB_CALLS
+    assert response.headers['X-DB-Budget'] == str(budget)
+    assert int(response.headers['X-DB-Calls']) <= budget
+
+def test_invalid_request_makes_no_db_calls(test_client):
+    """Test validation failures are rejected before any query"""
+    response = test_client.post('/login', data=json.dumps({'username': 'budgetuser'}),
+                                content_type='application/json')
+    assert response.status_code == 400
+    assert response.headers['X-DB-Calls'] == '0'
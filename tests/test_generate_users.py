@@ -0,0 +1,52 @@
+import json
+import pytest
+from bson import json_util
+from generate_users import generate_users, hash_pool, make_user
+
+@pytest.fixture(scope='module')
+def hashes():
+    """A small, cheap password hash pool"""
+    return hash_pool(size=2, rounds=4)
+
+def test_users_are_deterministic_and_unique(hashes):
+    """Test the same seed gives the same users and names never repeat"""
+    assert make_user(42, 7, hashes) == make_user(42, 7, hashes)
+    assert make_user(42, 7, hashes) != make_user(42, 8, hashes)
+
+    users = [make_user(index, 7, hashes) for index in range(5000)]
+    assert len({user['username'] for user in users}) == 5000
+    assert len({user['email'] for user in users}) == 5000
+    assert all(user['username_lower'] == user['username'] for user in users)
+
+def test_generated_users_can_log_in(test_client, mongo_db, hashes):
+    """Test generated users are inserted in batches and work with the app"""
+    users = mongo_db.users
+    stats = generate_users(250, target='mongomock', batch_size=100, hashes=hashes,
+                           collection=users, report=None)
+    assert stats['written'] == 250
+    assert users.count_documents({}) == 250
+
+    # Re-running the same range skips users that already exist
+    assert generate_users(250, target='mongomock', hashes=hashes, collection=users, report=None)['written'] == 0
+
+    user = make_user(3, 0, hashes)
+    response = test_client.post('/login', data=json.dumps({'username': user['username'], 'password': 'loadtest-1'}),
+                                content_type='application/json')
+    assert response.status_code == 200
+
+def test_jsonl_output(tmp_path, hashes):
+    """Test the JSONL target writes extended JSON in index order"""
+    output = tmp_path / 'users.jsonl'
+    stats = generate_users(30, target='jsonl', seed=3, start=10, batch_size=7, workers=2,
+                           hashes=hashes, output=str(output), report=None)
+    assert stats['written'] == 30
+
+    lines = output.read_text().splitlines()
+    assert [json_util.loads(line) for line in lines] == [make_user(index, 3, hashes) for index in range(10, 40)]
+
+def test_invalid_target():
+    """Test unknown targets and a missing JSONL file are rejected"""
+    with pytest.raises(ValueError):
+        generate_users(1, target='csv', hashes=['x'], report=None)
+    with pytest.raises(ValueError):
+        generate_users(1, target='jsonl', hashes=['x'], report=None)
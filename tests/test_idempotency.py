@@ -0,0 +1,106 @@
+import hashlib
+import json
+import pytest
+from datetime import datetime, timedelta
+from config import db
+from idempotency import response_cache
+
+def register(test_client, user_data, key):
+    return test_client.post('/register', 
+                            data=json.dumps(user_data),
+                            content_type='application/json',
+                            headers={'Idempotency-Key': key})
+
+def test_register_retry_replays_response(test_client):
+    """Test a retried registration returns the original response"""
+    user_data = {
+        'username': 'retryuser',
+        'email': 'retryuser@example.com',
+        'password': 'testpassword123'
+    }
+    first = register(test_client, user_data, 'key-1')
+    assert first.status_code == 201
+    
+    retry = register(test_client, user_data, 'key-1')
+    assert retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert json.loads(retry.data) == json.loads(first.data)
+    assert db.users.count_documents({}) == 1
+    
+    # Replayed from Mongo once the hot cache is gone
+    response_cache.clear()
+    retry = register(test_client, user_data, 'key-1')
+    assert json.loads(retry.data)['user_id'] == json.loads(first.data)['user_id']
+
+def test_key_reused_for_different_request(test_client):
+    """Test reusing a key with a different body is rejected"""
+    user_data = {
+        'username': 'retryuser',
+        'email': 'retryuser@example.com',
+        'password': 'testpassword123'
+    }
+    assert register(test_client, user_data, 'key-2').status_code == 201
+    
+    user_data['username'] = 'otheruser'
+    assert register(test_client, user_data, 'key-2').status_code == 422
+
+def test_in_progress_key_conflicts(test_client, monkeypatch):
+    """Test a duplicate of a request still running gets 409 after waiting"""
+    monkeypatch.setattr('idempotency.IDEMPOTENCY_WAIT_SECONDS', 0.1)
+    db.idempotency_keys.insert_one({'_id': '/register::key-3', 'status': 'in_progress', 'fingerprint': 'x'})
+    
+    response = register(test_client, {
+        'username': 'retryuser',
+        'email': 'retryuser@example.com',
+        'password': 'testpassword123'
+    }, 'key-3')
+    assert response.status_code == 409
+    assert db.users.count_documents({}) == 0
+
+def test_expired_claim_is_reclaimed(test_client):
+    """Test a key left in_progress by a crashed worker is retried once its lease expires"""
+    db.idempotency_keys.insert_one({'_id': '/register::key-6', 'status': 'in_progress', 'fingerprint': 'x',
+                                    'claim': 'dead', 'lease_until': datetime.utcnow() - timedelta(seconds=1)})
+
+    response = register(test_client, {
+        'username': 'retryuser',
+        'email': 'retryuser@example.com',
+        'password': 'testpassword123'
+    }, 'key-6')
+    assert response.status_code == 201
+    assert db.idempotency_keys.find_one({'_id': '/register::key-6'})['status'] == 'completed'
+
+def test_fingerprint_is_keyed(test_client):
+    """Test the stored fingerprint is not a plain hash of the body (which holds the password)"""
+    body = json.dumps({'username': 'retryuser', 'email': 'retryuser@example.com', 'password': 'testpassword123'})
+    test_client.post('/register', data=body, content_type='application/json', headers={'Idempotency-Key': 'key-7'})
+
+    fingerprint = db.idempotency_keys.find_one({'_id': '/register::key-7'})['fingerprint']
+    assert fingerprint != hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+def test_change_password_retry(test_client):
+    """Test a retried password change does not run twice"""
+    user_data = {
+        'username': 'retryuser',
+        'email': 'retryuser@example.com',
+        'password': 'testpassword123'
+    }
+    assert register(test_client, user_data, 'key-4').status_code == 201
+    login_response = test_client.post('/login', 
+                                      data=json.dumps({'username': 'retryuser', 'password': 'testpassword123'}),
+                                      content_type='application/json')
+    headers = {
+        'Authorization': f"Bearer {json.loads(login_response.data)['access_token']}",
+        'Idempotency-Key': 'key-5'
+    }
+    change = {'current_password': 'testpassword123', 'new_password': 'newpassword456'}
+    
+    first = test_client.post('/change-password', data=json.dumps(change),
+                             content_type='application/json', headers=headers)
+    assert first.status_code == 200
+    
+    # Running it again would fail: the current password has changed
+    retry = test_client.post('/change-password', data=json.dumps(change),
+                             content_type='application/json', headers=headers)
+    assert retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
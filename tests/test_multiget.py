@@ -0,0 +1,64 @@
+import json
+import pytest
+
+# DB calls are counted per request
+pytestmark = pytest.mark.usefixtures('db_stats')
+
+def test_users_in_request_order_with_misses(test_client, make_user, service_headers):
+    """Test one query returns every profile in request order and lists misses"""
+    users = [make_user(name) for name in ('multi1', 'multi2', 'multi3')]
+    ids, headers = [user['user_id'] for user in users], service_headers
+    unknown = '507f1f77bcf86cd799439011'
+
+    response = test_client.get(f'/users?ids={ids[2]},{unknown},{ids[0]}', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['X-DB-Calls'] == '1'
+    data = json.loads(response.data)
+    assert [user and user['username'] for user in data['users']] == ['multi3', None, 'multi1']
+    assert data['missing'] == [unknown]
+    assert 'password_hash' not in data['users'][0]
+
+    # Cached profiles are not queried again
+    response = test_client.post('/users', data=json.dumps({'ids': [ids[0], ids[1], ids[0]]}),
+                                content_type='application/json', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['X-DB-Calls'] == '1'
+    assert [user['username'] for user in json.loads(response.data)['users']] == ['multi1', 'multi2', 'multi1']
+
+    response = test_client.get(f'/users?ids={ids[0]},{ids[1]}', headers=headers)
+    assert response.headers['X-DB-Calls'] == '0'
+
+def test_profile_edit_clears_cached_profile(test_client, make_user, service_headers):
+    """Test a multi-get after an edit sees the new profile"""
+    user = make_user('multi4')
+    ids = [user['user_id']]
+    test_client.get(f'/users?ids={ids[0]}', headers=service_headers)
+
+    response = test_client.put('/profile', data=json.dumps({'first_name': 'Edited'}),
+                               content_type='application/json', headers=user['headers'])
+    assert response.status_code == 200
+
+    response = test_client.get(f'/users?ids={ids[0]}', headers=service_headers)
+    assert json.loads(response.data)['users'][0]['first_name'] == 'Edited'
+
+def test_invalid_ids(test_client, service_headers):
+    """Test malformed, missing and oversized id lists are rejected"""
+    headers = service_headers
+    for ids in ('', 'not-an-id', '507f1f77bcf86cd799439011,nope'):
+        response = test_client.get(f'/users?ids={ids}', headers=headers)
+        assert response.status_code == 400
+        assert response.headers['X-DB-Calls'] == '0'
+
+    for body in ({'ids': []}, {'ids': [None]}, {'ids': ['507f1f77bcf86cd799439011'] * 501}):
+        response = test_client.post('/users', data=json.dumps(body), content_type='application/json', headers=headers)
+        assert response.status_code == 400
+
+def test_user_tokens_cannot_read_other_profiles(test_client, make_user, service_headers):
+    """Test the multi-get is only open to internal services"""
+    user = make_user('multi6')
+    other = make_user('multi7')
+    response = test_client.get(f"/users?ids={other['user_id']}", headers=user['headers'])
+    assert response.status_code == 401
+    response = test_client.post('/users', data=json.dumps({'ids': [other['user_id']]}),
+                                content_type='application/json', headers=user['headers'])
+    assert response.status_code == 401
@@ -0,0 +1,158 @@
+import pytest
+import mongomock
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from activity import LoginActivityBuffer
+from models import User
+from partitioning import (
+    PartitionedDatabase, UserRouter, SLOT_COUNT, SLOT_FIELD,
+    slot_for_username, slot_for_object_id
+)
+from storage import InMemoryDatabase
+
+@pytest.fixture
+def partitioned_db():
+    """Three mongomock databases behind one PartitionedDatabase"""
+    mock_client = mongomock.MongoClient()
+    databases = [mock_client[f'partition_{i}'] for i in range(3)]
+    return PartitionedDatabase(UserRouter(databases, refresh_interval=0))
+
+def test_users_routed_by_username(partitioned_db):
+    """Test users land on the partition their username hashes to"""
+    router = partitioned_db.router
+    for i in range(12):
+        username = f'partuser{i}'
+        user_id = User.create_user(partitioned_db, username, f'{username}@example.com', 'testpassword123')
+
+        slot = slot_for_username(username)
+        assert slot_for_object_id(user_id) == slot
+        home = router.database_for_slot(slot)
+        assert home.users.find_one({'_id': user_id})[SLOT_FIELD] == slot
+
+    assert partitioned_db.users.count_documents({}) == 12
+
+def test_model_operations_on_partitions(partitioned_db):
+    """Test the User model works unchanged against partitioned storage"""
+    user_id = User.create_user(partitioned_db, 'partuser', 'partuser@example.com', 'testpassword123')
+
+    assert User.authenticate(partitioned_db, 'partuser', 'testpassword123') is not None
+    assert User.get_user_by_id(partitioned_db, str(user_id)).username == 'partuser'
+    assert User.update_user(partitioned_db, str(user_id), {'first_name': 'Part'})
+    assert User.get_user_by_id(partitioned_db, user_id).first_name == 'Part'
+
+    # Email uniqueness is checked across every partition
+    with pytest.raises(ValueError):
+        User.create_user(partitioned_db, 'otheruser', 'partuser@example.com', 'testpassword123')
+
+def test_rebalance_moves_slots(partitioned_db):
+    """Test rebalancing moves users to their new partition and keeps them reachable"""
+    ids = [
+        User.create_user(partitioned_db, f'partuser{i}', f'partuser{i}@example.com', 'testpassword123')
+        for i in range(10)
+    ]
+
+    # Collapse everything onto the first partition
+    moved = partitioned_db.router.rebalance([0] * SLOT_COUNT, settle_seconds=0)
+
+    assert moved > 0
+    assert partitioned_db.router.databases[0].users.count_documents({}) == 10
+    for i, user_id in enumerate(ids):
+        assert User.get_user_by_id(partitioned_db, user_id).username == f'partuser{i}'
+        assert User.authenticate(partitioned_db, f'partuser{i}', 'testpassword123') is not None
+
+def test_slot_map_is_shared(partitioned_db):
+    """Test other processes route by the stored map, whatever their partition list"""
+    databases = partitioned_db.router.databases
+    user_id = User.create_user(partitioned_db, 'shareduser', 'shareduser@example.com', 'testpassword123')
+
+    # A fourth partition added to the config does not own anything before a rebalance
+    grown = UserRouter(databases + [mongomock.MongoClient()['partition_3']])
+    assert grown.slot_map == partitioned_db.router.slot_map
+    assert User.get_user_by_id(PartitionedDatabase(grown), user_id).username == 'shareduser'
+
+    # Removing a partition that still owns slots is refused
+    with pytest.raises(ValueError):
+        UserRouter(databases[:2]).slot_map
+
+    # A rebalance reaches the other routers on their next refresh
+    other = UserRouter(databases, refresh_interval=0)
+    partitioned_db.router.rebalance([1] * SLOT_COUNT, settle_seconds=0)
+    assert set(other.slot_map) == {1}
+
+def test_username_lookup_falls_back(partitioned_db):
+    """Test a user not yet moved to its slot's owner is still found by username"""
+    User.create_user(partitioned_db, 'strayuser', 'strayuser@example.com', 'testpassword123')
+    databases = partitioned_db.router.databases
+    home = partitioned_db.router.slot_map[slot_for_username('strayuser')]
+    stray = databases[home].users.find_one({'username': 'strayuser'})
+    databases[home].users.delete_one({'_id': stray['_id']})
+    databases[(home + 1) % 3].users.insert_one(stray)
+
+    assert User.authenticate(partitioned_db, 'strayuser', 'testpassword123') is not None
+
+def test_rebalance_keeps_concurrent_writes(partitioned_db):
+    """Test a user changed while its slot is copied is not lost"""
+    user_id = User.create_user(partitioned_db, 'busyuser', 'busyuser@example.com', 'testpassword123')
+    router = partitioned_db.router
+    slot = slot_for_username('busyuser')
+    source = router.database_for_slot(slot).users
+    target = router.databases[(router.slot_map[slot] + 1) % 3].users
+
+    class EditDuringCopy:
+        """Source collection that sees an edit right after each snapshot"""
+        edits = ['Edited', None]
+
+        def find(self, *args, **kwargs):
+            docs = list(source.find(*args, **kwargs))
+            edit = self.edits.pop(0) if self.edits else None
+            if edit:
+                source.update_one({'_id': user_id}, {'$set': {'first_name': edit}})
+            return docs
+
+        def __getattr__(self, name):
+            return getattr(source, name)
+
+    assert router._move_slot(slot, EditDuringCopy(), target) == 1
+    assert source.count_documents({}) == 0
+    assert target.find_one({'_id': user_id})['first_name'] == 'Edited'
+
+def test_email_unique_across_partitions(partitioned_db):
+    """Test two inserts with one email fail even when they land on different partitions"""
+    router = partitioned_db.router
+    names = ['emailuser0'] + [f'emailuser{i}' for i in range(1, 50)]
+    other = next(name for name in names
+                 if router.slot_map[slot_for_username(name)] != router.slot_map[slot_for_username(names[0])])
+
+    partitioned_db.users.insert_one(User.user_document(names[0], 'shared@example.com', 'x'))
+    with pytest.raises(DuplicateKeyError):
+        partitioned_db.users.insert_one(User.user_document(other, 'shared@example.com', 'x'))
+    assert partitioned_db.users.count_documents({}) == 1
+
+    # Deleting the user frees the email
+    partitioned_db.users.delete_one({'username': names[0]})
+    partitioned_db.users.insert_one(User.user_document(other, 'shared@example.com', 'x'))
+    assert partitioned_db.users.find_one({'email': 'shared@example.com'})['username'] == other
+
+def test_bulk_write_runs_every_partition():
+    """Test a failing partition neither stops the others nor hides which writes failed"""
+    partitioned_db = PartitionedDatabase(UserRouter([InMemoryDatabase(f'partition_{i}') for i in range(2)],
+                                                    refresh_interval=0))
+    user_ids = [partitioned_db.users.insert_one({'username': f'bulkuser{i}', 'email': f'bulkuser{i}@example.com'})
+                .inserted_id for i in range(6)]
+    failing = partitioned_db.router.databases[0].users
+    failed_ids = {user_id for user_id in user_ids if failing.find_one({'_id': user_id})}
+    assert 0 < len(failed_ids) < 6
+
+    def failing_bulk_write(operations, ordered=True):
+        raise BulkWriteError({'writeErrors': [{'index': i, 'code': 50, 'errmsg': 'timeout'}
+                                              for i in range(len(operations))]})
+    failing.bulk_write = failing_bulk_write
+
+    buffer = LoginActivityBuffer(flush_interval=3600)
+    buffer._collection_getter = lambda: partitioned_db.users
+    for user_id in user_ids:
+        buffer.record(user_id)
+    assert buffer.flush() == 6 - len(failed_ids)
+
+    del failing.bulk_write
+    assert buffer.flush() == len(failed_ids)
+    assert [partitioned_db.users.find_one({'_id': user_id}).get('login_count') for user_id in user_ids] == [1] * 6
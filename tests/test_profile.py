@@ -2,29 +2,8 @@ import json
 import pytest
 from app import app
 from config import client, db
-import mongomock
 import uuid
 
-@pytest.fixture
-def test_client():
-    """Create a test client using Flask's test_config"""
-    app.config['TESTING'] = True
-    
-    # Mock MongoDB connection
-    mock_client = mongomock.MongoClient()
-    mock_db = mock_client.db
-    
-    # Replace the actual MongoDB client with mock client in the app
-    from config import client as mongo_client, db as mongo_db
-    mongo_client.admin = mock_client.admin
-    mongo_db.users = mock_db.users
-    
-    # Clear existing users before each test
-    mongo_db.users.delete_many({})
-    
-    with app.test_client() as test_flask_client:
-        yield test_flask_client
-
 def test_get_profile(test_client):
     """Test user profile retrieval"""
     # Generate unique username and email
@@ -271,4 +250,61 @@ def test_unauthorized_access(test_client):
         }),
         content_type='application/json'
     )
-    assert response.status_code == 401 
\ No newline at end of file
+    assert response.status_code == 401 
+def test_get_profile_sparse_fields(test_client):
+    """Test retrieving only selected profile fields"""
+    unique_username = f"testuser_{uuid.uuid4().hex[:8]}"
+    unique_email = f"{unique_username}@example.com"
+    
+    user_data = {
+        'username': unique_username,
+        'email': unique_email,
+        'password': 'testpassword123',
+        'first_name': 'Sparse'
+    }
+    register_response = test_client.post('/register', 
+                                         data=json.dumps(user_data),
+                                         content_type='application/json')
+    assert register_response.status_code == 201
+    
+    login_response = test_client.post('/login', 
+                                      data=json.dumps({
+                                          'username': unique_username,
+                                          'password': 'testpassword123'
+                                      }),
+                                      content_type='application/json')
+    assert login_response.status_code == 200
+    headers = {'Authorization': f"Bearer {json.loads(login_response.data)['access_token']}"}
+    
+    # Only the requested fields come back
+    response = test_client.get('/profile?fields=first_name,email', headers=headers)
+    assert response.status_code == 200
+    assert json.loads(response.data) == {'first_name': 'Sparse', 'email': unique_email}
+    
+    # Fields outside the allowlist are rejected
+    response = test_client.get('/profile?fields=first_name,password_hash', headers=headers)
+    assert response.status_code == 400
+    assert 'password_hash' in json.loads(response.data)['error']
+
+def test_user_record_round_trip():
+    """Test decoding a users document and encoding it for a response"""
+    from bson import ObjectId
+    from models import UserRecord
+    
+    user_id = ObjectId()
+    record = UserRecord.from_bson({
+        '_id': user_id,
+        'username': 'recorduser',
+        'email': 'recorduser@example.com',
+        'password_hash': 'not-a-real-hash',
+        'first_name': 'Record',
+        'partition_slot': 7
+    })
+    
+    assert not hasattr(record, '__dict__')
+    data = record.to_json()
+    assert data['_id'] == str(user_id)
+    assert data['username'] == 'recorduser'
+    assert 'password_hash' not in data
+    assert 'partition_slot' not in data
+    assert record.to_json(('first_name',)) == {'first_name': 'Record'}
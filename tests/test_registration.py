@@ -0,0 +1,96 @@
+import json
+import pytest
+from bson import ObjectId
+from app import app
+from datetime import datetime, timedelta
+from registration import registration_queue, DUPLICATE_ERROR
+
+@pytest.fixture(autouse=True)
+def async_registration(monkeypatch):
+    """Queue registrations instead of creating users in the request"""
+    monkeypatch.setitem(app.config, 'ASYNC_REGISTRATION', True)
+
+def register(client, username, email):
+    return client.post('/register', data=json.dumps({
+        'username': username,
+        'email': email,
+        'password': 'testpassword123'
+    }), content_type='application/json')
+
+def get_status(client, job_id):
+    response = client.get(f'/register/status/{job_id}')
+    assert response.status_code == 200
+    return json.loads(response.data)
+
+def test_registration_is_queued_and_processed(test_client, mongo_db):
+    """Test /register returns 202 and a worker creates the user"""
+    response = register(test_client, 'queueduser', 'queueduser@example.com')
+    assert response.status_code == 202
+    body = json.loads(response.data)
+    assert 'testpassword123' not in mongo_db.registration_jobs.find_one()['password']
+    assert response.headers['Location'] == body['status_url']
+    assert get_status(test_client, body['job_id'])['status'] == 'queued'
+    assert mongo_db.users.count_documents({}) == 0
+
+    assert registration_queue.process_batch(mongo_db) == 1
+
+    status = get_status(test_client, body['job_id'])
+    assert status['status'] == 'completed'
+    assert mongo_db.users.find_one({'username': 'queueduser'})['_id'] == ObjectId(status['user_id'])
+
+    # The password is only ever stored encrypted, and not kept after processing
+    assert 'password' not in mongo_db.registration_jobs.find_one()
+
+    response = test_client.post('/login', data=json.dumps({'username': 'queueduser', 'password': 'testpassword123'}),
+                                content_type='application/json')
+    assert response.status_code == 200
+
+def test_duplicate_registrations_fail_in_batch(test_client, mongo_db):
+    """Test names taken before or earlier in the same batch are reported as failures"""
+    first = json.loads(register(test_client, 'dupuser', 'dupuser@example.com').data)['job_id']
+    second = json.loads(register(test_client, 'dupuser', 'other@example.com').data)['job_id']
+    assert registration_queue.process_batch(mongo_db) == 2
+    assert get_status(test_client, first)['status'] == 'completed'
+    status = get_status(test_client, second)
+    assert status['status'] == 'failed'
+    assert status['error'] == DUPLICATE_ERROR
+    assert 'user_id' not in status
+
+    third = json.loads(register(test_client, 'another', 'dupuser@example.com').data)['job_id']
+    registration_queue.process_batch(mongo_db)
+    assert get_status(test_client, third)['status'] == 'failed'
+    assert mongo_db.users.count_documents({}) == 1
+
+    # Nothing left to claim
+    assert registration_queue.process_batch(mongo_db) == 0
+
+def test_reclaimed_batch_completes_inserted_users(test_client, mongo_db):
+    """Test a batch re-claimed after its lease ran out reports users already inserted as completed"""
+    job_id = json.loads(register(test_client, 'slowbatch', 'slowbatch@example.com').data)['job_id']
+
+    # The first worker inserts the user but stalls before recording the result
+    def stall(operations, ordered=True):
+        raise TimeoutError("worker stalled")
+    mongo_db.registration_jobs.bulk_write = stall
+    with pytest.raises(TimeoutError):
+        registration_queue.process_batch(mongo_db)
+    del mongo_db.registration_jobs.bulk_write
+
+    mongo_db.registration_jobs.update_one({}, {'$set': {'lease_until': datetime.utcnow() - timedelta(seconds=1)}})
+    assert registration_queue.process_batch(mongo_db) == 1
+
+    status = get_status(test_client, job_id)
+    assert status['status'] == 'completed'
+    assert status['user_id'] == str(mongo_db.users.find_one({'username': 'slowbatch'})['_id'])
+    assert mongo_db.users.count_documents({}) == 1
+
+def test_registration_status_errors(test_client):
+    """Test unknown and malformed job ids"""
+    assert test_client.get('/register/status/not-an-id').status_code == 400
+    assert test_client.get('/register/status/507f1f77bcf86cd799439011').status_code == 404
+
+def test_invalid_registration_is_not_queued(test_client, mongo_db):
+    """Test schema validation still happens before queueing"""
+    response = register(test_client, 'ab', 'not-an-email')
+    assert response.status_code == 400
+    assert mongo_db.registration_jobs.count_documents({}) == 0
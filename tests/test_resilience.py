@@ -0,0 +1,157 @@
+import json
+import pytest
+from pymongo import _csot
+from flask import g
+from app import app
+from resilience import CircuitBreaker, breaker, database_outcomes, record_database_outcome
+
+class DeadlineRecordingCollection:
+    """
+    Collection proxy remembering the pymongo deadline active for each call.
+    It also reports each call's outcome, as the command listener would: the
+    in-memory engine emits no command events.
+    """
+    def __init__(self, collection):
+        self._collection = collection
+        self.timeouts = []
+        self.outcome = True
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def recorded(*args, **kwargs):
+            self.timeouts.append(_csot.get_timeout())
+            record_database_outcome(self.outcome)
+            return attr(*args, **kwargs)
+        return recorded
+
+@pytest.fixture
+def users(mongo_db):
+    """The users collection, recording the deadline of each call"""
+    mongo_db.users = DeadlineRecordingCollection(mongo_db.users)
+    return mongo_db.users
+
+@pytest.fixture(autouse=True)
+def authorized_client(test_client, service_headers):
+    """Send the service token with every request and start with a closed breaker"""
+    breaker.state = CircuitBreaker.CLOSED
+    breaker._outcomes.clear()
+
+    test_client.environ_base['HTTP_X_SERVICE_TOKEN'] = service_headers['X-Service-Token']
+    yield test_client
+
+    breaker.state = CircuitBreaker.CLOSED
+    breaker._outcomes.clear()
+
+def test_mongo_calls_run_under_route_deadline(test_client, users):
+    """Test Mongo calls see the route deadline, shortened by X-Request-Timeout"""
+    response = test_client.get('/users/search?q=ab')
+    assert response.status_code == 200
+    assert 0 < users.timeouts[-1] <= 2
+
+    response = test_client.get('/users/search?q=cd', headers={'X-Request-Timeout': '0.5'})
+    assert response.status_code == 200
+    assert 0 < users.timeouts[-1] <= 0.5
+
+    # A client cannot extend the route deadline
+    response = test_client.get('/users/search?q=ef', headers={'X-Request-Timeout': '60'})
+    assert response.status_code == 200
+    assert users.timeouts[-1] <= 2
+
+    # The deadline does not leak past the request
+    assert _csot.get_timeout() is None
+
+def test_invalid_request_timeout(test_client):
+    """Test a malformed X-Request-Timeout is rejected"""
+    for value in ('soon', '0', '-1'):
+        response = test_client.get('/users/search?q=ab', headers={'X-Request-Timeout': value})
+        assert response.status_code == 400
+        assert 'X-Request-Timeout' in json.loads(response.data)['error']
+
+def test_open_breaker_fails_fast(test_client, users):
+    """Test requests get 503 without touching Mongo while the breaker is open"""
+    for _ in range(breaker.min_requests):
+        breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    response = test_client.get('/users/search?q=ab')
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert users.timeouts == []
+
+    # Endpoints without database work are unaffected
+    assert test_client.get('/').status_code == 200
+
+def test_probe_without_database_call_does_not_close(test_client, users, monkeypatch):
+    """Test only a probe that reached the database decides the half-open state"""
+    monkeypatch.setattr(breaker, 'open_seconds', 0)
+    for _ in range(breaker.min_requests):
+        breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    response = test_client.get('/users/search?q=ab', headers={'X-Service-Token': 'wrong'})
+    assert response.status_code == 401
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    response = test_client.get('/users/search?q=ab')
+    assert response.status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_client_errors_do_not_dilute_failures(test_client, users):
+    """Test requests that never reach the database are not counted as healthy"""
+    users.outcome = False
+    # Distinct queries, so none is answered from the search cache
+    for i in range(breaker.min_requests // 2):
+        test_client.get(f'/users/search?q=a{i}')
+    for _ in range(breaker.min_requests * 2):
+        assert test_client.get('/users/search?q=ab', headers={'X-Service-Token': 'wrong'}).status_code == 401
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    for i in range(breaker.min_requests - breaker.min_requests // 2):
+        test_client.get(f'/users/search?q=b{i}')
+    assert breaker.state == CircuitBreaker.OPEN
+
+def test_command_failures_classified():
+    """Test network errors and unavailability codes fail, other replies show a live database"""
+    class Event:
+        def __init__(self, failure):
+            self.failure = failure
+
+    for failure, healthy in (({'errmsg': 'reset', 'errtype': 'AutoReconnect'}, False),
+                             ({'ok': 0, 'code': 50, 'errmsg': 'operation exceeded time limit'}, False),
+                             ({'ok': 0, 'code': 2, 'errmsg': 'bad value'}, True)):
+        with app.test_request_context():
+            database_outcomes.failed(Event(failure))
+            assert g.db_outcome is healthy
+
+def test_breaker_transitions():
+    """Test the breaker opens on errors, probes once when half-open and recovers"""
+    cb = CircuitBreaker(error_threshold=0.5, min_requests=4, window=30, open_seconds=0)
+
+    # Below the minimum volume nothing trips
+    for _ in range(3):
+        cb.record(False)
+    assert cb.state == CircuitBreaker.CLOSED
+
+    cb.record(True)
+    assert cb.state == CircuitBreaker.OPEN
+
+    # open_seconds elapsed: exactly one probe is admitted
+    assert cb.allow()
+    assert cb.state == CircuitBreaker.HALF_OPEN
+    assert not cb.allow()
+
+    # A failed probe re-opens, a successful one closes
+    cb.record(False)
+    assert cb.state == CircuitBreaker.OPEN
+    assert cb.allow()
+    cb.record(True)
+    assert cb.state == CircuitBreaker.CLOSED
+    assert cb.allow()
+
+    # A healthy error rate keeps it closed
+    for ok in (True, True, True, False, True, True):
+        cb.record(ok)
+    assert cb.state == CircuitBreaker.CLOSED
@@ -0,0 +1,58 @@
+import json
+import pytest
+from config import db
+
+@pytest.fixture
+def users(make_user):
+    """Register a few users"""
+    return {username: make_user(username) for username in ('Alice', 'alicia', 'albert', 'bob', 'alfred')}
+
+@pytest.fixture
+def auth_headers(users, service_headers):
+    """Headers of the service allowed to search"""
+    return service_headers
+
+def test_search_prefix_case_insensitive(test_client, auth_headers):
+    """Test prefix search ignores case and only returns matches"""
+    response = test_client.get('/users/search?q=ALI', headers=auth_headers)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [u['username'] for u in data['users']] == ['Alice', 'alicia']
+    assert data['next'] is None
+    assert 'password_hash' not in data['users'][0]
+
+def test_search_keyset_pagination(test_client, auth_headers):
+    """Test paging through results with the next cursor"""
+    seen = []
+    after = ''
+    while True:
+        response = test_client.get(f'/users/search?q=al&limit=2&after={after}', headers=auth_headers)
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        seen.extend(u['username'] for u in data['users'])
+        if not data['next']:
+            break
+        after = data['next']
+    
+    assert seen == ['albert', 'alfred', 'Alice', 'alicia']
+
+def test_search_by_email_and_cache(test_client, auth_headers):
+    """Test email search and that repeated prefixes are served from the cache"""
+    response = test_client.get('/users/search?q=bo&field=email', headers=auth_headers)
+    assert [u['email'] for u in json.loads(response.data)['users']] == ['bob@example.com']
+    
+    db.users.delete_many({})
+    cached = test_client.get('/users/search?q=bo&field=email', headers=auth_headers)
+    assert json.loads(cached.data) == json.loads(response.data)
+
+def test_search_invalid_params(test_client, auth_headers):
+    """Test missing query, bad field and bad cursor"""
+    assert test_client.get('/users/search', headers=auth_headers).status_code == 400
+    assert test_client.get('/users/search?q=a&field=name', headers=auth_headers).status_code == 400
+    assert test_client.get('/users/search?q=a&after=nope', headers=auth_headers).status_code == 400
+    assert test_client.get('/users/search?q=a').status_code == 401
+
+def test_search_rejects_user_tokens(test_client, users, service_headers):
+    """Test a user's own token cannot list other users"""
+    response = test_client.get('/users/search?q=al&field=email', headers=users['bob']['headers'])
+    assert response.status_code == 401
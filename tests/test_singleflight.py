@@ -0,0 +1,73 @@
+import threading
+import pytest
+import mongomock
+from concurrent.futures import ThreadPoolExecutor
+from models import User, user_lookups
+from singleflight import SingleFlight
+
+def run_concurrently(flight, key, fn, callers=8):
+    """Start callers together; the leader's fn blocks until all have joined"""
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        futures = [executor.submit(flight.do, key, fn) for _ in range(callers)]
+        return [f.exception() or f.result() for f in futures]
+
+def test_concurrent_calls_share_one_execution():
+    """Test callers arriving during a call get its result"""
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return 'result'
+    
+    threading.Timer(0.2, release.set).start()
+    results = run_concurrently(flight, 'key', slow)
+    
+    assert results == ['result'] * 8
+    assert len(calls) == 1
+    assert flight.executed == 1
+    assert flight.shared == 7
+    assert flight.stats()['in_flight'] == {}
+
+def test_exceptions_are_shared():
+    """Test waiters see the leader's exception and the key is released"""
+    flight = SingleFlight()
+    release = threading.Event()
+    
+    def failing():
+        release.wait(5)
+        raise RuntimeError("db down")
+    
+    threading.Timer(0.2, release.set).start()
+    results = run_concurrently(flight, 'key', failing, callers=4)
+    
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.do('key', lambda: 'recovered') == 'recovered'
+
+def test_get_user_by_id_coalesces(monkeypatch):
+    """Test concurrent lookups of one user issue a single find_one"""
+    mock_db = mongomock.MongoClient().db
+    user_id = User.create_user(mock_db, 'flightuser', 'flightuser@example.com', 'testpassword123')
+    
+    release = threading.Event()
+    queries = []
+    original_find_one = mock_db.users.find_one
+    
+    def slow_find_one(*args, **kwargs):
+        queries.append(1)
+        release.wait(5)
+        return original_find_one(*args, **kwargs)
+    monkeypatch.setattr(mock_db.users, 'find_one', slow_find_one)
+    
+    threading.Timer(0.2, release.set).start()
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        users = list(executor.map(lambda _: User.get_user_by_id(mock_db, str(user_id)), range(6)))
+    
+    assert [u.username for u in users] == ['flightuser'] * 6
+    assert len(queries) == 1
+    
+    # Read-after-write callers skip coalescing
+    User.get_user_by_id(mock_db, user_id, coalesce=False)
+    assert len(queries) == 2
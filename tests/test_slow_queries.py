@@ -0,0 +1,79 @@
+import json
+import logging
+from types import SimpleNamespace
+from pymongo import monitoring
+from app import app
+from slow_queries import SlowQueryMonitor
+
+class FakeDatabase:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def command(self, command):
+        self.calls.append(command)
+        return {
+            'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}},
+            'executionStats': {'executionTimeMillis': 250, 'totalKeysExamined': 0,
+                               'totalDocsExamined': 100000, 'nReturned': 1}
+        }
+
+class FakeClient:
+    nodes = frozenset({('localhost', 27017)})
+
+    def __init__(self):
+        self.calls = []
+
+    def __getitem__(self, name):
+        return FakeDatabase(self.calls)
+
+def command_events(request_id, duration_ms, command):
+    """Started and succeeded events for one find command"""
+    started = SimpleNamespace(command_name='find', request_id=request_id, command=command)
+    succeeded = SimpleNamespace(command_name='find', request_id=request_id, database_name='flask_db',
+                                duration_micros=int(duration_ms * 1000), connection_id=('localhost', 27017))
+    return started, succeeded
+
+def test_slow_query_is_explained(caplog):
+    """Test a slow command is logged with its route and explain plan"""
+    monitor = SlowQueryMonitor(threshold_ms=100)
+    client = FakeClient()
+    monitor.attach(client)
+    command = {'find': 'users', 'filter': {'username': 'slowuser'}, 'lsid': {'id': 1}, '$db': 'flask_db'}
+    
+    with caplog.at_level(logging.WARNING, logger='slow_queries'):
+        with app.test_request_context('/login', method='POST'):
+            started, succeeded = command_events(1, 250, command)
+            monitor.started(started)
+        monitor.succeeded(succeeded)
+        monitor.join()
+    
+    assert monitor.slow_count == 1
+    assert client.calls == [{'explain': {'find': 'users', 'filter': {'username': 'slowuser'}},
+                             'verbosity': 'executionStats'}]
+    entries = [json.loads(r.getMessage()) for r in caplog.records]
+    assert entries[0]['route'] == 'POST /login'
+    assert entries[1]['event'] == 'slow_query_explain'
+    assert entries[1]['docs_examined'] == 100000
+
+    # Only the command's shape is logged, never its values
+    assert entries[1]['command_document'] == {'find': 'users', 'filter': {'username': '?'}}
+    assert 'slowuser' not in caplog.text
+
+def test_fast_queries_and_rate_limit():
+    """Test fast commands are ignored and repeated shapes are explained once"""
+    monitor = SlowQueryMonitor(threshold_ms=100)
+    client = FakeClient()
+    monitor.attach(client)
+    
+    started, succeeded = command_events(1, 5, {'find': 'users', 'filter': {'_id': 1}})
+    monitor.started(started)
+    monitor.succeeded(succeeded)
+    
+    for request_id in range(2, 6):
+        started, succeeded = command_events(request_id, 500, {'find': 'users', 'filter': {'email': 'x'}})
+        monitor.started(started)
+        monitor.succeeded(succeeded)
+    monitor.join()
+    
+    assert monitor.slow_count == 4
+    assert len(client.calls) == 1
@@ -0,0 +1,112 @@
+import json
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from models import User
+from storage import InMemoryCollection, InMemoryDatabase
+
+@pytest.fixture
+def memory_db():
+    """A fresh in-memory database"""
+    return InMemoryDatabase()
+
+def test_unique_indexes_enforced(memory_db):
+    """Test username and email uniqueness without init_db"""
+    memory_db.users.insert_one({'username': 'memuser', 'email': 'memuser@example.com'})
+    
+    with pytest.raises(DuplicateKeyError):
+        memory_db.users.insert_one({'username': 'memuser', 'email': 'other@example.com'})
+    with pytest.raises(DuplicateKeyError):
+        memory_db.users.insert_one({'username': 'other', 'email': 'memuser@example.com'})
+    
+    other = memory_db.users.insert_one({'username': 'other', 'email': 'other@example.com'})
+    with pytest.raises(DuplicateKeyError):
+        memory_db.users.update_one({'_id': other.inserted_id}, {'$set': {'username': 'memuser'}})
+    
+    # Index stays consistent after a rename
+    memory_db.users.update_one({'_id': other.inserted_id}, {'$set': {'username': 'renamed'}})
+    assert memory_db.users.find_one({'username': 'renamed'})['_id'] == other.inserted_id
+    assert memory_db.users.find_one({'username': 'other'}) is None
+    
+    # insert_many reports every clashing index, as pymongo does
+    with pytest.raises(BulkWriteError) as error:
+        memory_db.users.insert_many([{'username': 'memuser'}, {'username': 'fresh'}, {'username': 'renamed'}],
+                                    ordered=False)
+    assert [e['index'] for e in error.value.details['writeErrors']] == [0, 2]
+    assert error.value.details['nInserted'] == 1
+
+def test_indexed_lookups_do_not_scan(memory_db, monkeypatch):
+    """Test equality, $in and $or lookups use the hash indexes"""
+    for i in range(100):
+        memory_db.users.insert_one({'username': f'user{i}', 'email': f'user{i}@example.com'})
+    
+    ids = [memory_db.users.find_one({'username': f'user{i}'})['_id'] for i in (5, 6)]
+    calls = []
+    import storage
+    original_matches = storage.matches
+    monkeypatch.setattr(storage, 'matches', lambda doc, query: calls.append(1) or original_matches(doc, query))
+    
+    assert memory_db.users.find_one({'username': 'user42'})['email'] == 'user42@example.com'
+    found = memory_db.users.find({'$or': [{'username': 'user1'}, {'email': 'user2@example.com'}]})
+    assert sorted(u['username'] for u in found) == ['user1', 'user2']
+    # A scan would evaluate all 100 documents
+    assert len(calls) < 10
+    
+    calls.clear()
+    found = memory_db.users.find({'username': {'$in': ['user3', 'user4', 'nobody']}})
+    assert sorted(u['username'] for u in found) == ['user3', 'user4']
+    assert len(memory_db.users.find({'_id': {'$in': ids}})) == 2
+    assert len(calls) == 4
+
+def test_queries_updates_and_projection(memory_db):
+    """Test the query and update operators the app relies on"""
+    users = memory_db.users
+    for name in ('carol', 'carl', 'dave'):
+        users.insert_one({'username': name, 'email': f'{name}@example.com', 'username_lower': name})
+    
+    found = users.find({'username_lower': {'$gte': 'car', '$lt': 'cas'}}, {'username': 1, '_id': 0},
+                       sort=[('username_lower', 1)], limit=5)
+    assert found == [{'username': 'carl'}, {'username': 'carol'}]
+    
+    user_id = users.find_one({'username': 'dave'})['_id']
+    users.bulk_write([UpdateOne({'_id': user_id}, {'$inc': {'login_count': 2}, '$max': {'last_login_at': 5}})])
+    users.bulk_write([UpdateOne({'_id': user_id}, {'$inc': {'login_count': 1}, '$max': {'last_login_at': 3}})])
+    dave = users.find_one({'_id': user_id}, {'password_hash': 0})
+    assert (dave['login_count'], dave['last_login_at']) == (3, 5)
+    
+    assert users.update_many({'username': {'$in': ['carol', 'carl']}}, {'$set': {'x': 1}}).modified_count == 2
+    assert users.count_documents({'x': 1}) == 2
+    assert users.delete_many({'x': {'$exists': True}}).deleted_count == 2
+    assert users.count_documents({}) == 1
+
+def test_models_on_memory_engine(memory_db):
+    """Test the User model against the in-memory engine"""
+    user_id = User.create_user(memory_db, 'memuser', 'memuser@example.com', 'testpassword123')
+    
+    assert User.authenticate(memory_db, 'memuser', 'testpassword123').id == user_id
+    assert User.get_user_by_id(memory_db, str(user_id)).email == 'memuser@example.com'
+    with pytest.raises(ValueError):
+        User.create_user(memory_db, 'memuser', 'new@example.com', 'testpassword123')
+
+def test_routes_on_memory_engine(test_client):
+    """Test register, login and profile through the app"""
+    user_data = {
+        'username': 'memuser',
+        'email': 'memuser@example.com',
+        'password': 'testpassword123'
+    }
+    assert test_client.post('/register', data=json.dumps(user_data),
+                            content_type='application/json').status_code == 201
+    
+    login_response = test_client.post('/login', 
+                                      data=json.dumps({'username': 'memuser', 'password': 'testpassword123'}),
+                                      content_type='application/json')
+    assert login_response.status_code == 200
+    tokens = json.loads(login_response.data)
+    
+    profile_response = test_client.get('/profile', headers={'Authorization': f"Bearer {tokens['access_token']}"})
+    assert json.loads(profile_response.data)['username'] == 'memuser'
+    
+    refresh_response = test_client.post('/token/refresh', 
+                                         headers={'Authorization': f"Bearer {tokens['refresh_token']}"})
+    assert refresh_response.status_code == 200
@@ -0,0 +1,66 @@
+import json
+import pytest
+from config import db
+from validation import validators, ValidationError
+
+def test_validators_compiled_from_swagger():
+    """Test every request schema in swagger.json has a compiled validator"""
+    for name in ('UserRegistration', 'UserLogin', 'ProfileUpdate', 'ChangePassword'):
+        assert callable(validators[name])
+
+def test_validator_field_errors():
+    """Test validators report the offending field"""
+    with pytest.raises(ValidationError) as exc_info:
+        validators['UserRegistration']({
+            'username': 'validuser',
+            'email': 'not-an-email',
+            'password': 'testpassword123'
+        })
+    assert exc_info.value.field == 'email'
+    assert str(exc_info.value) == 'Invalid email format'
+
+    with pytest.raises(ValidationError) as exc_info:
+        validators['ChangePassword']({
+            'current_password': 'testpassword123',
+            'new_password': '123'
+        })
+    assert exc_info.value.field == 'new_password'
+    assert str(exc_info.value) == 'New password must be at least 6 characters long'
+
+def test_register_wrong_type(test_client):
+    """Test registration rejects non-string fields before touching the database"""
+    user_data = {
+        'username': 'testuser',
+        'email': 'test@example.com',
+        'password': 12345678
+    }
+
+    response = test_client.post('/register',
+                                data=json.dumps(user_data),
+                                content_type='application/json')
+
+    assert response.status_code == 400
+    error_data = json.loads(response.data)
+    assert error_data['field'] == 'password'
+    assert db.users.count_documents({}) == 0
+
+def test_login_missing_body(test_client):
+    """Test login with a missing or non-object body"""
+    response = test_client.post('/login')
+    assert response.status_code == 400
+
+    response = test_client.post('/login',
+                                data=json.dumps(['testuser', 'testpassword123']),
+                                content_type='application/json')
+    assert response.status_code == 400
+    error_data = json.loads(response.data)
+    assert error_data['error'] == 'Request body must be a JSON object'
+
+def test_empty_optional_fields_count_as_missing(test_client, jwt_token):
+    """Test a profile update made only of empty strings is rejected"""
+    response = test_client.put('/profile',
+                               data=json.dumps({'first_name': ''}),
+                               content_type='application/json',
+                               headers={'Authorization': f'Bearer {jwt_token}'})
+    assert response.status_code == 400
+    assert json.loads(response.data)['error'] == 'No data provided'
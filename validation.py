@@ -0,0 +1,169 @@
+import json
+import os
+import re
+from functools import wraps
+from flask import request, jsonify
+
+# Compiled once and shared by the request validators and User.validate_email
+EMAIL_REGEX = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+SWAGGER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'swagger.json')
+
+FORMATS = {
+    'email': (EMAIL_REGEX.match, "Invalid email format"),
+}
+
+TYPES = {
+    'string': str,
+    'integer': int,
+    'boolean': bool,
+    'object': dict,
+    'array': list,
+}
+
+
+class ValidationError(ValueError):
+    """
+    Raised when a request body does not match its schema
+    """
+    def __init__(self, message, field=None):
+        super().__init__(message)
+        self.field = field
+
+    def to_dict(self):
+        error = {'error': str(self)}
+        if self.field:
+            error['field'] = self.field
+        return error
+
+
+def _label(field):
+    """
+    Turn a field name into a human readable label (new_password -> New password)
+    """
+    return field.replace('_', ' ').capitalize()
+
+
+def _compile_property(field, schema):
+    """
+    Build the list of checks for a single property
+    """
+    checks = []
+    label = _label(field)
+
+    expected_type = TYPES.get(schema.get('type'))
+    if expected_type is not None:
+        type_message = f"{label} must be of type {schema['type']}"
+
+        def check_type(value, expected_type=expected_type, type_message=type_message):
+            # bool is a subclass of int, but never a valid integer here
+            if not isinstance(value, expected_type) or (expected_type is int and isinstance(value, bool)):
+                return type_message
+        checks.append(check_type)
+
+    if 'minLength' in schema:
+        min_length = schema['minLength']
+        min_message = f"{label} must be at least {min_length} characters long"
+        checks.append(lambda value: min_message if len(value) < min_length else None)
+
+    if 'maxLength' in schema:
+        max_length = schema['maxLength']
+        max_message = f"{label} must be at most {max_length} characters long"
+        checks.append(lambda value: max_message if len(value) > max_length else None)
+
+    if 'minItems' in schema:
+        min_items = schema['minItems']
+        min_items_message = f"{label} must contain at least {min_items} items"
+        checks.append(lambda value: min_items_message if len(value) < min_items else None)
+
+    if 'maxItems' in schema:
+        max_items = schema['maxItems']
+        max_items_message = f"{label} must contain at most {max_items} items"
+        checks.append(lambda value: max_items_message if len(value) > max_items else None)
+
+    if schema.get('format') in FORMATS:
+        matcher, format_message = FORMATS[schema['format']]
+        checks.append(lambda value: format_message if matcher(value) is None else None)
+
+    return checks
+
+
+def compile_schema(schema):
+    """
+    Compile an object schema into a callable that raises ValidationError
+    """
+    required = tuple(schema.get('required', ()))
+    min_properties = schema.get('minProperties', 0)
+    properties = tuple(
+        (field, tuple(_compile_property(field, field_schema)))
+        for field, field_schema in schema.get('properties', {}).items()
+    )
+
+    def validate(data):
+        if data is None:
+            data = {}
+        if not isinstance(data, dict):
+            raise ValidationError("Request body must be a JSON object")
+
+        # Empty strings and nulls count as missing, as they always have
+        for field in required:
+            if data.get(field) in (None, ''):
+                raise ValidationError("Missing required fields", field)
+
+        # Optional fields sent as null or '' are likewise treated as absent
+        present = 0
+        for field, checks in properties:
+            value = data.get(field)
+            if value is None or value == '':
+                continue
+            present += 1
+            for check in checks:
+                message = check(value)
+                if message:
+                    raise ValidationError(message, field)
+
+        if present < min_properties:
+            raise ValidationError("No data provided" if present == 0
+                                  else f"At least {min_properties} fields are required")
+
+        return data
+
+    return validate
+
+
+def load_validators(path=SWAGGER_PATH):
+    """
+    Compile every object schema declared in the swagger document
+    """
+    with open(path) as swagger_file:
+        swagger = json.load(swagger_file)
+
+    schemas = swagger.get('components', {}).get('schemas', {})
+    return {
+        name: compile_schema(schema)
+        for name, schema in schemas.items()
+        if schema.get('type') == 'object'
+    }
+
+
+# Compiled at import time so requests only pay for the checks themselves
+validators = load_validators()
+
+
+def validate_body(schema_name):
+    """
+    Reject the request with a 400 before the view runs if its JSON body
+    does not match the named schema
+    """
+    validator = validators[schema_name]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                validator(request.get_json(silent=True))
+            except ValidationError as ve:
+                return jsonify(ve.to_dict()), 400
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator